@@ -1,16 +1,14 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.runnables import chain
+from pydantic import BaseModel, Field, ValidationError
+from langchain_core.runnables import RunnableLambda
 
+from ingestion import logger
+from ingestion.models.chat import create_chat_model
 from ingestion.models.multimodal import MultiModal
+from ingestion.utils.llm_cache import to_messages
+from ingestion.utils.llm_scheduler import PRIORITY_ELEMENT_SUMMARY, estimate_message_tokens
 
 
-@chain
-def extract_image_summary(data_batches):
-    llm = ChatOpenAI(
-        temperature=0,
-        model_name="gpt-4o-mini",
-    )
-
+def create_image_summary_prompts(data_batches):
     system_prompt = """You are an expert in extracting useful information from IMAGE.
 With a given image, your task is to extract key entities, summarize them, and write useful information that can be used later for retrieval.
 Also, provide five hypothetical questions based on the image that users can ask.
@@ -51,21 +49,10 @@ Output must be written in {language}.
         system_prompts.append(system_prompt)
         user_prompts.append(user_prompt_template)
 
-    multimodal_llm = MultiModal(llm)
-
-    answer = multimodal_llm.batch(
-        image_paths, system_prompts, user_prompts, display_image=False
-    )
-    return answer
+    return image_paths, system_prompts, user_prompts
 
 
-@chain
-def extract_table_summary(data_batches):
-    llm = ChatOpenAI(
-        temperature=0,
-        model_name="gpt-4o-mini",
-    )
-
+def create_table_summary_prompts(data_batches):
     system_prompt = """You are an expert in extracting useful information from TABLE. 
 With a given image, your task is to extract key entities, summarize them, and write useful information that can be used later for retrieval.
 If the numbers are present, summarize important insights from the numbers.
@@ -110,21 +97,10 @@ Output must be written in {language}.
         system_prompts.append(system_prompt)
         user_prompts.append(user_prompt_template)
 
-    multimodal_llm = MultiModal(llm)
-
-    answer = multimodal_llm.batch(
-        image_paths, system_prompts, user_prompts, display_image=False
-    )
-    return answer
+    return image_paths, system_prompts, user_prompts
 
 
-@chain
-def table_markdown_extractor(data_batches):
-    llm = ChatOpenAI(
-        temperature=0,
-        model_name="gpt-4o-mini",
-    )
-
+def create_table_markdown_prompts(data_batches):
     system_prompt = "You are an expert in converting image of the TABLE into markdown format. Be sure to include all the information in the table. DO NOT narrate, just answer in markdown format."
 
     image_paths = []
@@ -147,9 +123,134 @@ Output must be written in Korean.
         system_prompts.append(system_prompt)
         user_prompts.append(user_prompt_template)
 
-    multimodal_llm = MultiModal(llm)
+    return image_paths, system_prompts, user_prompts
+
+
+class TableExtraction(BaseModel):
+    title: str = Field(description="Title of the table")
+    summary: str = Field(description="Summary of the table")
+    entities: list[str] = Field(description="Key entities in the table")
+    data_insights: list[str] = Field(description="Important insights from the numbers")
+    hypothetical_questions: list[str] = Field(description="Five questions users can ask")
+    markdown: str = Field(description="The whole table in markdown format")
+
+
+def create_table_extraction_prompts(data_batches):
+    system_prompt = """You are an expert in extracting useful information from TABLE.
+With a given image, your task is to extract key entities, summarize them, and write useful information that can be used later for retrieval.
+If the numbers are present, summarize important insights from the numbers.
+Also, provide five hypothetical questions based on the image that users can ask.
+Finally, convert the table into markdown format. Be sure to include all the information in the table.
+"""
+
+    image_paths = []
+    system_prompts = []
+    user_prompts = []
+
+    for data_batch in data_batches:
+        context = data_batch["text"]
+        image_path = data_batch["table"]
+        language = data_batch["language"]
+        user_prompt_template = f"""Here is the context related to the image of table: {context}
+
+###
+
+Do not wrap the markdown in ```markdown``` or any XML tags.
+Output must be written in {language}.
+"""
+        image_paths.append(image_path)
+        system_prompts.append(system_prompt)
+        user_prompts.append(user_prompt_template)
+
+    return image_paths, system_prompts, user_prompts
+
+
+def format_table_summary(extraction: TableExtraction) -> str:
+    def lines(items):
+        return "\n".join(f"- {item}" for item in items)
+
+    return f"""<table>
+<title>
+{extraction.title}
+</title>
+<summary>
+{extraction.summary}
+</summary>
+<entities>
+{lines(extraction.entities)}
+</entities>
+<data_insights>
+{lines(extraction.data_insights)}
+</data_insights>
+<hypothetical_questions>
+{lines(extraction.hypothetical_questions)}
+</hypothetical_questions>
+</table>"""
+
+
+def parse_table_extraction(content):
+    try:
+        return TableExtraction.model_validate_json(content)
+    except ValidationError as e:
+        logger.warning(f"Failed to parse table extraction: {e}")
+        return None
+
+
+def create_multimodal_chain(name, namespace, create_prompts, priority=PRIORITY_ELEMENT_SUMMARY,
+                            response_format=None, parse=None, lossless=False):
+    def create_multimodal_llm():
+        llm = create_chat_model(namespace, priority=priority)
+        if response_format is not None:
+            llm = llm.bind(response_format=response_format)
+        return MultiModal(llm, lossless=lossless)
+
+    def run(data_batches):
+        answers = create_multimodal_llm().batch(*create_prompts(data_batches), display_image=False)
+        return [parse(answer) for answer in answers] if parse else answers
+
+    async def arun(data_batches):
+        answers = await create_multimodal_llm().abatch(*create_prompts(data_batches),
+                                                       display_image=False)
+        return [parse(answer) for answer in answers] if parse else answers
+
+    return RunnableLambda(run, afunc=arun, name=name)
+
+
+def estimate_table_extraction_cost(data_batches, model_name="gpt-4o-mini"):
+    multimodal_llm = MultiModal(None, lossless=True)
+
+    def estimate(create_prompts):
+        return sum(
+            estimate_message_tokens(
+                to_messages(multimodal_llm.create_messages(*prompts, display_image=False)),
+                model_name,
+            )
+            for prompts in zip(*create_prompts(data_batches))
+        )
+
+    return {
+        "two_call": {
+            "calls": 2 * len(data_batches),
+            "input_tokens": (estimate(create_table_summary_prompts)
+                             + estimate(create_table_markdown_prompts)),
+        },
+        "combined": {
+            "calls": len(data_batches),
+            "input_tokens": estimate(create_table_extraction_prompts),
+        },
+    }
+
 
-    answer = multimodal_llm.batch(
-        image_paths, system_prompts, user_prompts, display_image=False
-    )
-    return answer
\ No newline at end of file
+extract_image_summary = create_multimodal_chain(
+    "extract_image_summary", "image_summary", create_image_summary_prompts
+)
+extract_table_summary = create_multimodal_chain(
+    "extract_table_summary", "table_summary", create_table_summary_prompts, lossless=True
+)
+table_markdown_extractor = create_multimodal_chain(
+    "table_markdown_extractor", "table_markdown", create_table_markdown_prompts, lossless=True
+)
+extract_table_summary_and_markdown = create_multimodal_chain(
+    "extract_table_summary_and_markdown", "table_extraction", create_table_extraction_prompts,
+    response_format=TableExtraction, parse=parse_table_extraction, lossless=True,
+)
@@ -8,6 +8,17 @@ BASE_DIR = Path.cwd().parent
 RESOURCES_DIR = BASE_DIR / "resources"
 ORIGINAL_DIR = RESOURCES_DIR / "original"
 PROCESSED_DIR = RESOURCES_DIR / "processed"
+CACHE_DIR = RESOURCES_DIR / "cache"
+LAYOUT_CACHE_DIR = CACHE_DIR / "layout"
+LLM_CACHE_DIR = CACHE_DIR / "llm"
+IMAGE_CACHE_DIR = CACHE_DIR / "images"
+EMBEDDING_CACHE_DIR = CACHE_DIR / "embeddings"
+
+LLM_REQUESTS_PER_MINUTE = 500
+LLM_TOKENS_PER_MINUTE = 200000
+CHECKPOINT_DIR = RESOURCES_DIR / "checkpoints"
+INDEX_DIR = RESOURCES_DIR / "indexes"
+RETRIEVER_INDEX_DIR = INDEX_DIR / "retriever"
 
 def get_file_paths(doc_type):
     original_pdf = ORIGINAL_DIR / f"{doc_type}.pdf"
@@ -0,0 +1,12 @@
+from langchain_openai import ChatOpenAI
+
+from ingestion.utils.llm_cache import CachedChatModel
+from ingestion.utils.llm_scheduler import ScheduledChatModel, PRIORITY_DEFAULT
+
+
+def create_chat_model(namespace, priority=PRIORITY_DEFAULT, model_name="gpt-4o-mini",
+                      temperature=0, **kwargs):
+    # Retries go through the scheduler: 429s pause every caller, while connection errors,
+    # timeouts and 5xx responses back off only the failing call.
+    llm = ChatOpenAI(model_name=model_name, temperature=temperature, max_retries=0, **kwargs)
+    return CachedChatModel(ScheduledChatModel(llm, priority=priority), namespace=namespace)
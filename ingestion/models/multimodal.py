@@ -1,14 +1,19 @@
-import os
 import base64
+import asyncio
 import requests
 from IPython.display import Image, display
 
+from ingestion.utils.image_preparer import get_image_preparer
+
 
 class MultiModal:
-    def __init__(self, model, system_prompt=None, user_prompt=None):
+    def __init__(self, model, system_prompt=None, user_prompt=None, image_preparer=None,
+                 lossless=False):
         self.model = model
         self.system_prompt = system_prompt
         self.user_prompt = user_prompt
+        self.image_preparer = image_preparer
+        self.lossless = lossless
         self.init_prompt()
 
     def init_prompt(self):
@@ -32,16 +37,8 @@ class MultiModal:
             raise Exception("Failed to download image")
 
     def encode_image_from_file(self, file_path):
-        with open(file_path, "rb") as image_file:
-            image_content = image_file.read()
-            file_ext = os.path.splitext(file_path)[1].lower()
-            if file_ext in [".jpg", ".jpeg"]:
-                mime_type = "image/jpeg"
-            elif file_ext == ".png":
-                mime_type = "image/png"
-            else:
-                mime_type = "image/unknown"
-            return f"data:{mime_type};base64,{base64.b64encode(image_content).decode('utf-8')}"
+        image_preparer = self.image_preparer or get_image_preparer()
+        return image_preparer.prepare(file_path, lossless=self.lossless)
 
     def encode_image(self, image_path):
         if str(image_path).startswith("http://") or str(image_path).startswith("https://"):
@@ -113,6 +110,24 @@ class MultiModal:
         response = self.model.batch(messages)
         return [r.content for r in response]
 
+    async def abatch(
+        self,
+        image_urls: list[str],
+        system_prompts: list[str] = [],
+        user_prompts: list[str] = [],
+        display_image=False,
+    ):
+        messages = []
+        for image_url, system_prompt, user_prompt in zip(
+            image_urls, system_prompts, user_prompts
+        ):
+            message = await asyncio.to_thread(
+                self.create_messages, image_url, system_prompt, user_prompt, display_image
+            )
+            messages.append(message)
+        response = await self.model.abatch(messages)
+        return [r.content for r in response]
+
     def stream(
         self, image_url, system_prompt=None, user_prompt=None, display_image=True
     ):
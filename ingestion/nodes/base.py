@@ -1,19 +1,49 @@
+import os
 import json
+import asyncio
 from abc import ABC, abstractmethod
+from langchain_core.runnables import RunnableLambda
 
 from ingestion import logger
 from ingestion.states import FileState
 
 
 class BaseNode(ABC):
-    def __init__(self, verbose=False, **kwargs):
+    outputs = ()
+
+    def __init__(self, verbose=False, skip_if_valid=False, **kwargs):
         self.name = self.__class__.__name__
         self.verbose = verbose
+        self.skip_if_valid = skip_if_valid
 
     @abstractmethod
     def execute(self, state: FileState) -> FileState:
         pass
 
+    async def aexecute(self, state: FileState) -> FileState:
+        return await asyncio.to_thread(self.execute, state)
+
+    def output_files(self, state: FileState) -> list[str]:
+        return []
+
+    # Outputs are only reused for the source PDF they were produced from.
+    def input_fingerprint(self, state: FileState) -> str | None:
+        return state.get("source_hash")
+
+    def is_output_valid(self, state: FileState) -> bool:
+        if not self.outputs or any(state.get(key) is None for key in self.outputs):
+            return False
+        fingerprint = self.input_fingerprint(state)
+        if fingerprint is None or (state.get("node_fingerprints") or {}).get(self.name) != fingerprint:
+            return False
+        return all(path and os.path.exists(path) for path in self.output_files(state))
+
+    def should_skip(self, state: FileState) -> bool:
+        if self.skip_if_valid and self.is_output_valid(state):
+            self.log("Skipped: outputs are already valid", outputs=list(self.outputs))
+            return True
+        return False
+
     def log(self, message: str, **kwargs):
         if self.verbose:
             log_data = {
@@ -28,5 +58,24 @@ class BaseNode(ABC):
             log_method = getattr(logger, "info", logger.info)
             log_method(log_message)
 
+    def skipped_result(self, state: FileState) -> FileState:
+        return FileState({key: state[key] for key in self.outputs})
+
+    def record_fingerprint(self, state: FileState, result: FileState) -> FileState:
+        fingerprint = self.input_fingerprint(state)
+        if self.outputs and fingerprint is not None:
+            result["node_fingerprints"] = {self.name: fingerprint}
+        return result
+
     def __call__(self, state: FileState) -> FileState:
-        return self.execute(state)
\ No newline at end of file
+        if self.should_skip(state):
+            return self.skipped_result(state)
+        return self.record_fingerprint(state, self.execute(state))
+
+    async def acall(self, state: FileState) -> FileState:
+        if self.should_skip(state):
+            return self.skipped_result(state)
+        return self.record_fingerprint(state, await self.aexecute(state))
+
+    def as_runnable(self) -> RunnableLambda:
+        return RunnableLambda(self.__call__, afunc=self.acall, name=self.name)
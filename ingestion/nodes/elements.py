@@ -1,16 +1,41 @@
+import os
 import re
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 from ingestion.states import FileState
 from ingestion.nodes.base import BaseNode
-from ingestion.utils.image_processor import ImageCropper
+from ingestion.utils.image_processor import (
+    ClipRegionCropper,
+    crop_elements,
+    shard_jobs_by_page,
+)
+from ingestion.utils.image_hash import (
+    MAX_HAMMING_DISTANCE,
+    MAX_ASPECT_RATIO_DIFF,
+    MAX_COLOR_DIFF,
+    group_similar_images,
+)
+from ingestion.utils.element_store import ElementStore
+from ingestion.utils.boilerplate import (
+    MARGIN_RATIO,
+    MIN_PAGE_RATIO,
+    MIN_PAGES,
+    BoilerplateDetector,
+)
 from ingestion.chains.summary import table_markdown_extractor
+from ingestion.utils.llm_cache import llm_cache_stats
+from ingestion.utils.image_preparer import get_image_preparer
 
 
 class ElementsNode(BaseNode):
-    def __init__(self, **kwargs):
+    outputs = ("page_metadata", "page_elements")
+
+    def __init__(self, compact=False, **kwargs):
         super().__init__(**kwargs)
         self.name = self.__class__.__name__
+        self.compact = compact
 
     def extract_page_num(self, file_basename):
         name_pattern =  r'.*_(\d{3})_(\d{3})\.json$'
@@ -23,6 +48,34 @@ class ElementsNode(BaseNode):
             self.log(f"Invalid file basename: {file_basename}")
             return None, None
 
+    def read_analyzed_json(self, json_file_path):
+        with open(json_file_path, "r") as f:
+            json_data = json.load(f)
+
+        start_page_num, end_page_num = self.extract_page_num(json_file_path)
+
+        page_metadata = dict()
+        elements = []
+
+        for element in json_data["metadata"]["pages"]:
+            original_page_num = int(element["page"])
+            relative_page_num = start_page_num + original_page_num - 1
+
+            metadata = {
+                "size" : [
+                    int(element["width"]),
+                    int(element["height"]) 
+                ],
+            }
+            page_metadata[relative_page_num] = metadata
+
+        for element in json_data["elements"]:
+            original_page_num = int(element["page"])
+            element["page"] = start_page_num + original_page_num - 1
+            elements.append(element)
+
+        return page_metadata, elements
+
     def execute(self, state: FileState) -> FileState:
         json_file_paths = sorted(
             info["analyzed_json_file_path"]
@@ -34,26 +87,11 @@ class ElementsNode(BaseNode):
         element_id = 0
 
         for json_file_path in json_file_paths:
-            with open(json_file_path, "r") as f:
-                json_data = json.load(f)
-
-            start_page_num, end_page_num = self.extract_page_num(json_file_path)
-
-            for element in json_data["metadata"]["pages"]:
-                original_page_num = int(element["page"])
-                relative_page_num = start_page_num + original_page_num - 1
-
-                metadata = {
-                    "size" : [
-                        int(element["width"]),
-                        int(element["height"]) 
-                    ],
-                }
-                page_metadata[relative_page_num] = metadata
+            json_page_metadata, elements = self.read_analyzed_json(json_file_path)
+            page_metadata.update(json_page_metadata)
 
-            for element in json_data["elements"]:
-                original_page_num = int(element["page"])
-                relative_page_num = start_page_num + original_page_num - 1
+            for element in elements:
+                relative_page_num = element["page"]
 
                 if relative_page_num not in page_elements:
                     page_elements[relative_page_num] = []
@@ -61,10 +99,14 @@ class ElementsNode(BaseNode):
                 element["id"] = element_id
                 element_id += 1
 
-                element["page"] = relative_page_num
                 page_elements[relative_page_num].append(element)
         
         parsed_page_elements = self.extract_tag_elements_per_page(page_elements)
+
+        if self.compact:
+            self.log("ElementsNode execution completed",
+                     num_total_element=element_id,
+                     compact_bytes=parsed_page_elements.nbytes())
         
         return FileState(
             page_metadata=page_metadata,
@@ -72,6 +114,11 @@ class ElementsNode(BaseNode):
         )
     
     def extract_tag_elements_per_page(self, page_elements):
+        if self.compact:
+            return ElementStore.from_elements(
+                element for elements in page_elements.values() for element in elements
+            )
+
         parsed_page_elements = dict()
 
         for key, page_elements in page_elements.items():
@@ -98,11 +145,51 @@ class ElementsNode(BaseNode):
         return parsed_page_elements
 
 
+class BoilerplateFilterNode(BaseNode):
+    outputs = ("page_elements",)
+
+    def __init__(self, mode="collapse", margin_ratio=MARGIN_RATIO, min_page_ratio=MIN_PAGE_RATIO,
+                 min_pages=MIN_PAGES, **kwargs):
+        super().__init__(**kwargs)
+        self.name = self.__class__.__name__
+        self.mode = mode
+        self.margin_ratio = margin_ratio
+        self.min_page_ratio = min_page_ratio
+        self.min_pages = min_pages
+
+    def execute(self, state: FileState) -> FileState:
+        detector = BoilerplateDetector(mode=self.mode,
+                                       margin_ratio=self.margin_ratio,
+                                       min_page_ratio=self.min_page_ratio,
+                                       min_pages=self.min_pages)
+        page_elements, removed, reasons = detector.filter(state["page_elements"],
+                                                          state["page_metadata"])
+
+        removed_ids = {element_id for element_ids in removed.values() for element_id in element_ids}
+        removed_chars = sum(len(element.get("text", ""))
+                            for page in state["page_elements"].values()
+                            for element in page["text_elements"] if element["id"] in removed_ids)
+
+        self.log("BoilerplateFilterNode execution completed",
+                 mode=self.mode,
+                 num_removed_elements=len(removed_ids),
+                 removed_chars=removed_chars,
+                 reasons=reasons,
+                 repeated_texts=sorted(text for _, text in detector.repeated_keys))
+
+        return FileState(page_elements=page_elements)
+
+
 class ImageCropperNode(BaseNode):
+    outputs = ("image_paths",)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.name = self.__class__.__name__
 
+    def output_files(self, state: FileState) -> list[str]:
+        return list(state["image_paths"].values())
+
     def execute(self, state: FileState) -> FileState:
         pdf_file = state["file_paths"]["original_pdf"]
         page_numbers = list(state["page_metadata"].keys())
@@ -110,32 +197,66 @@ class ImageCropperNode(BaseNode):
         output_dir = state["file_paths"]["processed_dir"] / "figures"
 
         cropped_images = dict()
-        for page_num in page_numbers:
-            figure_elements = state["page_elements"].get(page_num, {}).get("figure_elements", [])
-            for element in figure_elements:
-                if element["category"] == "figure":
-                    output_file = output_dir / f"{element['id']}.png"
-                    cropped_images[element["id"]] = output_file
-                    ImageCropper.process_pdf_page(
-                        pdf_file=pdf_file,
-                        page_num=page_num,
-                        coordinates=element["bounding_box"],
-                        page_size=state["page_metadata"][page_num]["size"],
-                        output_file=output_file,
-                        dpi=300
-                    )
-                    
+        with ClipRegionCropper(pdf_file, dpi=300) as cropper:
+            for page_num in page_numbers:
+                figure_elements = state["page_elements"].get(page_num, {}).get("figure_elements", [])
+                for element in figure_elements:
+                    if element["category"] == "figure":
+                        output_file = output_dir / f"{element['id']}.png"
+                        cropped_images[element["id"]] = output_file
+                        cropper.crop(
+                            page_num=page_num,
+                            coordinates=element["bounding_box"],
+                            page_size=state["page_metadata"][page_num]["size"],
+                            output_file=output_file,
+                        )
+
         self.log("ImageCropperNode execution completed",
-                 num_total_image=len(cropped_images))
+                 num_total_image=len(cropped_images),
+                 render_stats=cropper.summary(),
+                 page_render_stats=cropper.page_stats)
         
         return FileState(image_paths=cropped_images)
 
 
+class ImageDedupNode(BaseNode):
+    outputs = ("image_groups",)
+
+    def __init__(self, max_distance=MAX_HAMMING_DISTANCE,
+                 max_aspect_ratio_diff=MAX_ASPECT_RATIO_DIFF, max_color_diff=MAX_COLOR_DIFF,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.name = self.__class__.__name__
+        self.max_distance = max_distance
+        self.max_aspect_ratio_diff = max_aspect_ratio_diff
+        self.max_color_diff = max_color_diff
+
+    def execute(self, state: FileState) -> FileState:
+        image_groups = group_similar_images(state["image_paths"],
+                                            max_distance=self.max_distance,
+                                            max_aspect_ratio_diff=self.max_aspect_ratio_diff,
+                                            max_color_diff=self.max_color_diff)
+
+        self.log("ImageDedupNode execution completed",
+                 num_total_image=len(state["image_paths"]),
+                 num_unique_image=len(image_groups),
+                 saved_calls=len(state["image_paths"]) - len(image_groups),
+                 duplicate_groups={image_id: members for image_id, members
+                                   in image_groups.items() if len(members) > 1})
+
+        return FileState(image_groups=image_groups)
+
+
 class TableCropperNode(BaseNode):
+    outputs = ("table_paths",)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.name = self.__class__.__name__
 
+    def output_files(self, state: FileState) -> list[str]:
+        return list(state["table_paths"].values())
+
     def execute(self, state: FileState) -> FileState:
         pdf_file = state["file_paths"]["original_pdf"]
         page_numbers = list(state["page_metadata"].keys())
@@ -143,28 +264,102 @@ class TableCropperNode(BaseNode):
         output_dir = state["file_paths"]["processed_dir"] / "tables"
 
         cropped_tables = dict()
-        for page_num in page_numbers:
-            figure_elements = state["page_elements"].get(page_num, {}).get("table_elements", [])
-            for element in figure_elements:
-                if element["category"] == "table":
-                    output_file = output_dir / f"{element['id']}.png"
-                    cropped_tables[element["id"]] = output_file
-                    ImageCropper.process_pdf_page(
-                        pdf_file=pdf_file,
-                        page_num=page_num,
-                        coordinates=element["bounding_box"],
-                        page_size=state["page_metadata"][page_num]["size"],
-                        output_file=output_file,
-                        dpi=300
-                    )
-                    
-        self.log("ImageCropperNode execution completed",
-                 num_total_table=len(cropped_tables))
+        with ClipRegionCropper(pdf_file, dpi=300) as cropper:
+            for page_num in page_numbers:
+                table_elements = state["page_elements"].get(page_num, {}).get("table_elements", [])
+                for element in table_elements:
+                    if element["category"] == "table":
+                        output_file = output_dir / f"{element['id']}.png"
+                        cropped_tables[element["id"]] = output_file
+                        cropper.crop(
+                            page_num=page_num,
+                            coordinates=element["bounding_box"],
+                            page_size=state["page_metadata"][page_num]["size"],
+                            output_file=output_file,
+                        )
+
+        self.log("TableCropperNode execution completed",
+                 num_total_table=len(cropped_tables),
+                 render_stats=cropper.summary(),
+                 page_render_stats=cropper.page_stats)
         
         return FileState(table_paths=cropped_tables)
 
 
+class ElementCropperNode(BaseNode):
+    outputs = ("image_paths", "table_paths")
+
+    def __init__(self, max_workers=None, dpi=300, **kwargs):
+        super().__init__(**kwargs)
+        self.name = self.__class__.__name__
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.dpi = dpi
+
+    def create_crop_jobs(self, state: FileState):
+        processed_dir = state["file_paths"]["processed_dir"]
+        page_numbers = sorted(state["page_metadata"].keys())
+
+        jobs = []
+        cropped_images = dict()
+        cropped_tables = dict()
+
+        for page_num in page_numbers:
+            page = state["page_elements"].get(page_num, {})
+            page_size = state["page_metadata"][page_num]["size"]
+
+            for key, category, subdir, cropped in (
+                ("figure_elements", "figure", "figures", cropped_images),
+                ("table_elements", "table", "tables", cropped_tables),
+            ):
+                for element in page.get(key, []):
+                    if element["category"] != category:
+                        continue
+                    output_file = processed_dir / subdir / f"{element['id']}.png"
+                    cropped[element["id"]] = output_file
+                    jobs.append({
+                        "page_num": page_num,
+                        "coordinates": element["bounding_box"],
+                        "page_size": page_size,
+                        "output_file": output_file,
+                    })
+
+        return jobs, cropped_images, cropped_tables
+
+    def output_files(self, state: FileState) -> list[str]:
+        return [*state["image_paths"].values(), *state["table_paths"].values()]
+
+    def execute(self, state: FileState) -> FileState:
+        pdf_file = state["file_paths"]["original_pdf"]
+        jobs, cropped_images, cropped_tables = self.create_crop_jobs(state)
+        shards = shard_jobs_by_page(jobs, self.max_workers)
+
+        start_time = time.perf_counter()
+        page_stats = dict()
+
+        if len(shards) <= 1:
+            for shard in shards:
+                page_stats.update(crop_elements(pdf_file, shard, self.dpi))
+        else:
+            with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+                futures = [executor.submit(crop_elements, pdf_file, shard, self.dpi)
+                           for shard in shards]
+                for future in futures:
+                    page_stats.update(future.result())
+
+        self.log("ElementCropperNode execution completed",
+                 num_workers=len(shards),
+                 num_total_image=len(cropped_images),
+                 num_total_table=len(cropped_tables),
+                 pixels_rendered=sum(s["pixels_rendered"] for s in page_stats.values()),
+                 seconds=round(time.perf_counter() - start_time, 4),
+                 page_render_stats=dict(sorted(page_stats.items())))
+
+        return FileState(image_paths=cropped_images, table_paths=cropped_tables)
+
+
 class ExtractTextNode(BaseNode):
+    outputs = ("texts",)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.name = self.__class__.__name__
@@ -187,20 +382,48 @@ class ExtractTextNode(BaseNode):
 
 
 class TableMarkdownExtractorNode(BaseNode):
+    outputs = ("table_markdowns",)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.name = "TableMarkdownExtractorNode"
 
-    def execute(self, state: FileState):
-        table_markdowns = table_markdown_extractor.invoke(
-            state["table_summary_batches"],
-        )
-
+    def create_table_markdown_data_batches(self, state: FileState):
+        data_batches = []
+
+        for page_num in sorted(state["page_elements"].keys()):
+            for table_element in state["page_elements"][page_num]["table_elements"]:
+                table_id = int(table_element["id"])
+                data_batches.append(
+                    {
+                        "table": state["table_paths"][table_id],
+                        "page": page_num,
+                        "id": table_id,
+                    }
+                )
+        return data_batches
+
+    def create_result(self, data_batches, table_markdowns):
         table_markdown_output = dict()
 
-        for data_batch, table_summary in zip(
-            state["table_summary_batches"], table_markdowns
-        ):
-            table_markdown_output[data_batch["id"]] = table_summary
+        for data_batch, table_markdown in zip(data_batches, table_markdowns):
+            table_markdown_output[data_batch["id"]] = table_markdown
+
+        self.log("TableMarkdownExtractorNode execution completed",
+                 num_total_table=len(table_markdown_output),
+                 image_payload=get_image_preparer().payload_stats(
+                     [data_batch["table"] for data_batch in data_batches]
+                 ),
+                 llm_cache=llm_cache_stats("table_markdown"))
 
-        return FileState(table_markdowns=table_markdown_output)
\ No newline at end of file
+        return FileState(table_markdowns=table_markdown_output)
+
+    def execute(self, state: FileState):
+        data_batches = self.create_table_markdown_data_batches(state)
+        table_markdowns = table_markdown_extractor.invoke(data_batches)
+        return self.create_result(data_batches, table_markdowns)
+
+    async def aexecute(self, state: FileState):
+        data_batches = self.create_table_markdown_data_batches(state)
+        table_markdowns = await table_markdown_extractor.ainvoke(data_batches)
+        return self.create_result(data_batches, table_markdowns)
@@ -1,32 +1,212 @@
 import os
+import re
 import json
-import random
 import asyncio
-import aiohttp
+from pathlib import Path
 
 from ingestion.states import FileState
 from ingestion.nodes.base import BaseNode
-from ingestion.utils.layout_analyzer import LayoutAnalyzeRequester
+from ingestion.utils.async_runner import run_sync
+from ingestion.utils.layout_cache import LayoutCache
+from ingestion.utils.local_layout import (
+    LocalLayoutAnalyzer,
+    LOCAL_ANALYZER_VERSION,
+)
+from ingestion.utils.page_classifier import classify_pages, ROUTE_LOCAL
+from ingestion.utils.pdf_source import resolve_split_source
+from ingestion.utils.layout_analyzer import (
+    LayoutAnalyzeRequester,
+    UPSTAGE_ANALYZER_VERSION,
+)
+
+
+LAYOUT_BACKENDS = ("upstage", "local", "hybrid")
 
 
 class LayoutNode(BaseNode):
-    def __init__(self, **kwargs):
+    outputs = ("analysis_request_info",)
+
+    def __init__(self, backend="upstage", max_concurrency=4, requests_per_second=2.0,
+                 max_retries=6, max_workers=None, cache_dir=None, cache_max_entries=20000,
+                 cache_max_bytes=1024 * 1024 * 1024, **kwargs):
         super().__init__(**kwargs)
         self.name = self.__class__.__name__
+        if backend not in LAYOUT_BACKENDS:
+            raise ValueError(f"Invalid layout backend: {backend}")
+        self.backend = backend
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self.cache_max_bytes = cache_max_bytes
 
-    def execute(self, state: FileState) -> FileState:
-        requester = LayoutAnalyzeRequester(os.environ.get('UPSTAGE_TOKEN'), 
-                                           state)
-        analysis_request_info = requester.execute_analysis_requests()
-        analysis_result_info = requester.excute_analysis_result_requests()
+    def output_files(self, state: FileState) -> list[str]:
+        return [info.get("analyzed_json_file_path")
+                for info in state["analysis_request_info"].values()]
+
+    def create_requester(self, state: FileState) -> LayoutAnalyzeRequester:
+        return LayoutAnalyzeRequester(os.environ.get('UPSTAGE_TOKEN'),
+                                      state,
+                                      max_concurrency=self.max_concurrency,
+                                      requests_per_second=self.requests_per_second,
+                                      max_retries=self.max_retries)
+
+    def create_cache(self):
+        if self.cache_dir is None:
+            return None
+        return LayoutCache(self.cache_dir,
+                           analyzer_version=UPSTAGE_ANALYZER_VERSION,
+                           max_entries=self.cache_max_entries,
+                           max_bytes=self.cache_max_bytes)
+
+    def prepare_remote_requests(self, cache: LayoutCache, requester: LayoutAnalyzeRequester,
+                                local_file_paths=()):
+        analysis_request_info = requester.load_request_info()
+        splitted_file_buffers = requester.splitted_file_buffers
+        content_keys = dict()
+
+        for file_path, info in analysis_request_info.items():
+            if file_path in local_file_paths:
+                continue
+
+            if info.get("analyzer") == LOCAL_ANALYZER_VERSION:
+                info.update(request_id=None, analyzed_json_file_path=None, analyzer=None)
+
+            source = resolve_split_source(file_path, splitted_file_buffers)
+            if cache is None or source is None:
+                continue
+
+            key = cache.key(source)
+            content_keys[file_path] = key
+            json_data = cache.get(key)
+
+            if json_data is not None:
+                json_file_path = os.path.join(requester.analyzed_json_paths,
+                                              Path(file_path).stem + ".json")
+                with open(json_file_path, "w") as f:
+                    json.dump(json_data, f, ensure_ascii=False, indent=4)
+                info.update(analyzed_json_file_path=json_file_path, content_hash=key)
+            elif info.get("content_hash") != key:
+                info.update(request_id=None, analyzed_json_file_path=None, content_hash=key)
+            elif info["analyzed_json_file_path"] and os.path.exists(info["analyzed_json_file_path"]):
+                self.store_cache(cache, key, info["analyzed_json_file_path"])
+
+        requester.save_request_info(analysis_request_info)
+        return content_keys
+
+    def store_cache(self, cache: LayoutCache, key, json_file_path):
+        with open(json_file_path, "r") as f:
+            cache.put(key, json.load(f))
+
+    def load_request_info(self, state: FileState):
+        with open(state["file_paths"]["analyze_request_info"], "r") as f:
+            return json.load(f)
+
+    def save_request_info(self, state: FileState, analysis_request_info):
+        with open(state["file_paths"]["analyze_request_info"], "w") as f:
+            json.dump(analysis_request_info, f, indent=4)
+
+    def analyze_locally(self, state: FileState, file_paths):
+        analyzer = LocalLayoutAnalyzer(state["file_paths"]["analyzed_jsons"],
+                                       max_workers=self.max_workers)
+        return analyzer.analyze_files(file_paths)
+
+    def run_local_analysis(self, state: FileState, file_paths):
+        analysis_request_info = self.load_request_info(state)
+
+        for file_path, json_file_path in self.analyze_locally(state, file_paths).items():
+            analysis_request_info[file_path].update(
+                request_id=None,
+                analyzed_json_file_path=json_file_path,
+                analyzer=LOCAL_ANALYZER_VERSION,
+            )
+        self.save_request_info(state, analysis_request_info)
+        return analysis_request_info
+
+    def split_page_range(self, file_path):
+        match = re.match(r'.*_(\d{3,})_(\d{3,})\.pdf$', str(file_path))
+        if match is None:
+            return None
+        start_page, end_page = match.groups()
+        return range(int(start_page), int(end_page) + 1)
+
+    def route_local_files(self, state: FileState):
+        page_routes = state.get("page_routes")
+        if page_routes is None:
+            page_routes = {page_num: stats["route"] for page_num, stats
+                           in classify_pages(state["file_paths"]["original_pdf"]).items()}
+
+        local_file_paths = []
+        for file_path in self.load_request_info(state):
+            page_range = self.split_page_range(file_path)
+            if resolve_split_source(file_path) is None or not page_range:
+                continue
+            if all(page_routes.get(page_num) == ROUTE_LOCAL for page_num in page_range):
+                local_file_paths.append(file_path)
+
+        return local_file_paths
+
+    def execute_local(self, state: FileState) -> FileState:
+        file_paths = [file_path for file_path in self.load_request_info(state)
+                      if resolve_split_source(file_path) is not None]
+        analysis_request_info = self.run_local_analysis(state, file_paths)
+
+        self.log("LayoutNode execution completed",
+                 backend=self.backend,
+                 total_files=len(analysis_request_info),
+                 analyzed_files=len(file_paths))
+
+        return FileState(analysis_request_info=analysis_request_info)
+
+    async def aexecute(self, state: FileState) -> FileState:
+        if self.backend == "local":
+            return await asyncio.to_thread(self.execute_local, state)
+
+        local_file_paths = []
+        if self.backend == "hybrid":
+            local_file_paths = await asyncio.to_thread(self.route_local_files, state)
+            await asyncio.to_thread(self.run_local_analysis, state, local_file_paths)
+
+        return await self.aexecute_remote(state, local_file_paths)
+
+    async def aexecute_remote(self, state: FileState, local_file_paths=()) -> FileState:
+        cache = self.create_cache()
+
+        async with self.create_requester(state) as requester:
+            content_keys = await asyncio.to_thread(
+                self.prepare_remote_requests, cache, requester, set(local_file_paths)
+            )
+
+            async for result in requester.iter_analysis_jobs():
+                self.log("Layout analysis job finished",
+                         file_path=result["file_path"],
+                         analyzed_json_file_path=result["result"],
+                         num_polls=result["num_polls"],
+                         seconds=result["seconds"])
+
+                if cache is not None and result["result"] and result["file_path"] in content_keys:
+                    self.store_cache(cache, content_keys[result["file_path"]], result["result"])
+
+            analysis_request_info = requester.load_request_info()
+
+        cache_stats = dict()
+        if cache is not None:
+            cache_stats = {**cache.stats(), "evicted": await asyncio.to_thread(cache.evict)}
 
         self.log("LayoutNode execution completed", 
                  total_requests=len(analysis_request_info),
                  sucessed_requests=len([info for info 
                                         in analysis_request_info.values() if info["request_id"]]),
                  succed_get_result_requests=len([info for info 
-                                                 in analysis_result_info.values() 
-                                                 if info["analyzed_json_file_path"]])
+                                                 in analysis_request_info.values() 
+                                                 if info["analyzed_json_file_path"]]),
+                 local_files=len(local_file_paths),
+                 cache=cache_stats
         )
         
-        return FileState(analysis_request_info=analysis_request_info)
\ No newline at end of file
+        return FileState(analysis_request_info=analysis_request_info)
+
+    def execute(self, state: FileState) -> FileState:
+        return run_sync(self.aexecute(state))
@@ -5,6 +5,9 @@ from pathlib import Path
 
 from ingestion.states import FileState
 from ingestion.nodes.base import BaseNode
+from ingestion.utils.processed_document import sha256_file
+from ingestion.utils.page_classifier import classify_pages, ROUTE_LOCAL
+from ingestion.utils.pdf_source import get_split_buffer, register_split_buffers
 
 
 class InitPDFNode(BaseNode):
@@ -23,6 +26,7 @@ class InitPDFNode(BaseNode):
             file_paths=file_paths,
             file_basename=file_basename,
             file_type=file_type,
+            source_hash=sha256_file(original_pdf_path),
             language=self.language
         )
         
@@ -33,10 +37,17 @@ class InitPDFNode(BaseNode):
 
 
 class SplitPDFNode(BaseNode):
-    def __init__(self, batch_size=1, **kwargs):
+    outputs = ("splitted_file_paths",)
+
+    def __init__(self, batch_size=1, in_memory=False, persist=True, **kwargs):
         super().__init__(**kwargs)
         self.name = self.__class__.__name__
         self.batch_size = batch_size
+        self.in_memory = in_memory
+        self.persist = persist or not in_memory
+
+    def output_files(self, state: FileState) -> list[str]:
+        return [path for path in state["splitted_file_paths"] if get_split_buffer(path) is None]
 
     def execute(self, state: FileState) -> FileState:
         file_paths = state["file_paths"]
@@ -45,19 +56,29 @@ class SplitPDFNode(BaseNode):
         analyze_request_info_path = file_paths["analyze_request_info"]
         split_size = self.batch_size
 
-        base_file = pymupdf.open(original_pdf_path)
-        num_total_page = base_file.page_count
-
         splitted_file_paths = []
+        splitted_file_buffers = dict()
+
+        with pymupdf.open(original_pdf_path) as base_file:
+            num_total_page = base_file.page_count
 
-        for start_page in range(0, num_total_page, split_size):
-            end_page = min(start_page + split_size, num_total_page) - 1
-            result_file_name = f"{state['file_basename']}_{start_page:03d}_{end_page:03d}.pdf"
-            with pymupdf.open() as result_file:
-                result_file.insert_pdf(base_file, from_page=start_page, to_page=end_page)
-                result_file_path = os.path.join(splitted_file_base_path, result_file_name)
-                result_file.save(result_file_path)
-                splitted_file_paths.append(result_file_path)
+            for start_page in range(0, num_total_page, split_size):
+                end_page = min(start_page + split_size, num_total_page) - 1
+                result_file_name = f"{state['file_basename']}_{start_page:03d}_{end_page:03d}.pdf"
+                with pymupdf.open() as result_file:
+                    result_file.insert_pdf(base_file, from_page=start_page, to_page=end_page)
+                    result_file_path = os.path.join(splitted_file_base_path, result_file_name)
+
+                    if self.in_memory:
+                        splitted_file_buffers[result_file_path] = result_file.tobytes()
+                        if self.persist:
+                            with open(result_file_path, "wb") as f:
+                                f.write(splitted_file_buffers[result_file_path])
+                    else:
+                        result_file.save(result_file_path)
+                    splitted_file_paths.append(result_file_path)
+
+        register_split_buffers(splitted_file_buffers)
 
         analyze_request_info = {path: {"request_id": None, "analyzed_json_file_path": None} 
                                 for path in splitted_file_paths}
@@ -88,5 +109,28 @@ class SplitPDFNode(BaseNode):
         self.log("SplitPDFNode execution completed", 
                  num_total_page=num_total_page, 
                  num_split_files=len(splitted_file_paths),
+                 in_memory=self.in_memory,
+                 persisted=self.persist,
         )
         return result
+
+
+class PageClassifierNode(BaseNode):
+    outputs = ("page_routes",)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.name = self.__class__.__name__
+
+    def execute(self, state: FileState) -> FileState:
+        page_stats = classify_pages(state["file_paths"]["original_pdf"])
+        page_routes = {page_num: stats["route"] for page_num, stats in page_stats.items()}
+
+        num_local_pages = len([route for route in page_routes.values() if route == ROUTE_LOCAL])
+        self.log("PageClassifierNode execution completed",
+                 num_total_page=len(page_routes),
+                 num_local_pages=num_local_pages,
+                 num_remote_pages=len(page_routes) - num_local_pages,
+                 page_stats=page_stats)
+
+        return FileState(page_routes=page_routes)
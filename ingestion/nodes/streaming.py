@@ -0,0 +1,463 @@
+import os
+import json
+import time
+import asyncio
+import functools
+import pymupdf
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from langchain_core.documents import Document
+
+from ingestion.chains.summary import (
+    extract_image_summary,
+    extract_table_summary,
+    table_markdown_extractor,
+)
+from ingestion.states import FileState
+from ingestion.nodes.base import BaseNode
+from ingestion.nodes.layout import LayoutNode
+from ingestion.nodes.elements import ElementsNode
+from ingestion.nodes.summary import PageSummaryNode
+from ingestion.utils.async_runner import gather_or_cancel, run_sync
+from ingestion.utils.image_processor import ClipRegionCropper
+from ingestion.utils.layout_analyzer import LayoutAnalyzeRequester
+from ingestion.utils.llm_cache import llm_cache_stats
+from ingestion.utils.local_layout import analyze_pdf_to_file, LOCAL_ANALYZER_VERSION
+from ingestion.utils.page_classifier import classify_pages, ROUTE_LOCAL
+from ingestion.utils.pdf_source import resolve_split_source
+
+
+STAGE_DONE = object()
+
+
+class StreamingIngestionNode(BaseNode):
+    outputs = ("analysis_request_info", "page_summaries", "image_summaries",
+               "table_summaries", "table_markdowns")
+
+    def __init__(self, api_key, batch_size=1, queue_size=8,
+                 layout_concurrency=4, summary_concurrency=4, dpi=300,
+                 layout_backend="upstage", layout_cache_dir=None,
+                 in_memory_splits=False, persist_splits=True, compact_elements=False, **kwargs):
+        super().__init__(**kwargs)
+        self.name = self.__class__.__name__
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.layout_concurrency = layout_concurrency
+        self.summary_concurrency = summary_concurrency
+        self.dpi = dpi
+        self.in_memory_splits = in_memory_splits
+        self.persist_splits = persist_splits or not in_memory_splits
+        self.layout_node = LayoutNode(backend=layout_backend, cache_dir=layout_cache_dir)
+        self.elements_node = ElementsNode(compact=compact_elements)
+        self.page_summary_node = PageSummaryNode(api_key=api_key)
+
+    def output_files(self, state: FileState) -> list[str]:
+        return [*self.layout_node.output_files(state),
+                *state["image_paths"].values(), *state["table_paths"].values()]
+
+    async def run_stage(self, worker, input_queue, output_queue, concurrency=1):
+        async def consume():
+            while True:
+                item = await input_queue.get()
+                if item is STAGE_DONE:
+                    await input_queue.put(STAGE_DONE)
+                    return
+                for output in await worker(item):
+                    await output_queue.put(output)
+
+        await gather_or_cancel(*(consume() for _ in range(concurrency)))
+        await output_queue.put(STAGE_DONE)
+
+    async def run_pdf_task(self, run, func, *args, **kwargs):
+        # PyMuPDF is not thread-safe, so every in-process call goes through one thread.
+        return await asyncio.get_running_loop().run_in_executor(
+            run["pdf_executor"], functools.partial(func, *args, **kwargs)
+        )
+
+    def split_pdf(self, base_file, state, start_page, end_page):
+        result_file_name = f"{state['file_basename']}_{start_page:03d}_{end_page:03d}.pdf"
+        result_file_path = os.path.join(state["file_paths"]["splitted_pdfs"], result_file_name)
+        with pymupdf.open() as result_file:
+            result_file.insert_pdf(base_file, from_page=start_page, to_page=end_page)
+            if not self.in_memory_splits:
+                result_file.save(result_file_path)
+                return result_file_path, None
+            buffer = result_file.tobytes()
+
+        if self.persist_splits:
+            with open(result_file_path, "wb") as f:
+                f.write(buffer)
+        return result_file_path, buffer
+
+    async def produce_splits(self, state, run, output_queue):
+        base_file = await self.run_pdf_task(run, pymupdf.open, state["file_paths"]["original_pdf"])
+        try:
+            num_total_page = await self.run_pdf_task(run, lambda: base_file.page_count)
+            run["num_total_page"] = num_total_page
+
+            for start_page in range(0, num_total_page, self.batch_size):
+                end_page = min(start_page + self.batch_size, num_total_page) - 1
+                file_path, buffer = await self.run_pdf_task(
+                    run, self.split_pdf, base_file, state, start_page, end_page
+                )
+                if buffer is not None:
+                    run["splitted_file_buffers"][file_path] = buffer
+                run["splitted_file_paths"].append(file_path)
+                await output_queue.put(file_path)
+        finally:
+            await self.run_pdf_task(run, base_file.close)
+
+        await output_queue.put(STAGE_DONE)
+
+    async def analyze_layout_locally(self, file_path, run):
+        json_file_path = os.path.join(run["requester"].analyzed_json_paths,
+                                      Path(file_path).stem + ".json")
+        await asyncio.get_running_loop().run_in_executor(
+            run["layout_executor"], analyze_pdf_to_file,
+            resolve_split_source(file_path, run["splitted_file_buffers"]), json_file_path
+        )
+        run["analysis_request_info"][file_path] = {
+            "splitted_file_path": file_path,
+            "request_id": None,
+            "analyzed_json_file_path": json_file_path,
+            "analyzer": LOCAL_ANALYZER_VERSION,
+        }
+        return json_file_path
+
+    async def analyze_layout_remotely(self, file_path, run):
+        previous_info = run["previous_request_info"].get(file_path, {})
+        json_file_path = previous_info.get("analyzed_json_file_path")
+        if previous_info.get("analyzer") == LOCAL_ANALYZER_VERSION:
+            json_file_path = None
+        request_id = previous_info.get("request_id")
+        cache = run["layout_cache"]
+        content_hash = None
+
+        if cache is not None:
+            content_hash = await self.run_pdf_task(
+                run, cache.key, resolve_split_source(file_path, run["splitted_file_buffers"])
+            )
+            json_data = cache.get(content_hash)
+            if json_data is not None:
+                json_file_path = os.path.join(run["requester"].analyzed_json_paths,
+                                              Path(file_path).stem + ".json")
+                await asyncio.to_thread(self.write_json, json_file_path, json_data)
+            elif previous_info.get("content_hash") != content_hash:
+                json_file_path = None
+
+        if json_file_path is None or not os.path.exists(json_file_path):
+            # A saved request id is only resumed for the same content and remote analyzer.
+            if (previous_info.get("analyzer") == LOCAL_ANALYZER_VERSION
+                    or previous_info.get("content_hash") != content_hash):
+                request_id = None
+            result = await run["requester"].analyze_file(
+                file_path, request_id,
+                on_submitted=lambda request_id: self.save_submitted_request(
+                    run, file_path, request_id, content_hash),
+            )
+            request_id, json_file_path = result["request_id"], result["result"]
+            if cache is not None and json_file_path is not None:
+                await asyncio.to_thread(self.layout_node.store_cache, cache, content_hash, json_file_path)
+
+        run["analysis_request_info"][file_path] = {
+            "splitted_file_path": file_path,
+            "request_id": request_id,
+            "analyzed_json_file_path": json_file_path,
+            "content_hash": content_hash,
+        }
+        return json_file_path
+
+    async def route_layout(self, file_path, run):
+        if self.layout_node.backend != "hybrid":
+            return self.layout_node.backend
+        page_stats = await self.run_pdf_task(
+            run, classify_pages, resolve_split_source(file_path, run["splitted_file_buffers"])
+        )
+        if all(stats["route"] == ROUTE_LOCAL for stats in page_stats.values()):
+            return "local"
+        return "upstage"
+
+    async def analyze_layout(self, file_path, run):
+        if await self.route_layout(file_path, run) == "local":
+            json_file_path = await self.analyze_layout_locally(file_path, run)
+        else:
+            json_file_path = await self.analyze_layout_remotely(file_path, run)
+        run["splitted_file_buffers"].pop(file_path, None)
+
+        if json_file_path is None:
+            self.log(f"Layout analysis failed: {file_path}")
+            return []
+
+        page_metadata, elements = await asyncio.to_thread(
+            self.elements_node.read_analyzed_json, json_file_path
+        )
+
+        pages = {
+            page_num: {"page_num": page_num, "metadata": metadata, "elements": []}
+            for page_num, metadata in page_metadata.items()
+        }
+        for element_index, element in enumerate(elements):
+            element["id"] = (json_file_path, element_index)
+            pages.setdefault(
+                element["page"], {"page_num": element["page"], "metadata": None, "elements": []}
+            )["elements"].append(element)
+
+        # Like ElementsNode, elements on pages without metadata keep their ids; with no
+        # page size there is nothing to crop or summarize, so they skip the later stages.
+        missing_pages = [page for page in pages.values() if page["metadata"] is None]
+        for page in missing_pages:
+            run["pages"][page["page_num"]] = page
+        if missing_pages:
+            self.log(f"Pages without metadata: {json_file_path}",
+                     page_nums=[page["page_num"] for page in missing_pages],
+                     num_element=sum(len(page["elements"]) for page in missing_pages))
+
+        return [page for page in pages.values() if page["metadata"] is not None]
+
+    async def crop_page(self, page, run, cropper):
+        processed_dir = run["processed_dir"]
+        page_num = page["page_num"]
+        page["image_paths"] = dict()
+        page["table_paths"] = dict()
+        page["text"] = ""
+
+        for element in page["elements"]:
+            json_file_path, element_index = element["id"]
+            output_name = f"_{Path(json_file_path).stem}_{element_index:05d}.png"
+
+            if element["category"] in ("figure", "table"):
+                subdir, paths = (
+                    ("figures", page["image_paths"]) if element["category"] == "figure"
+                    else ("tables", page["table_paths"])
+                )
+                output_file = processed_dir / subdir / output_name
+                paths[element["id"]] = output_file
+                run["crop_paths"].append(output_file)
+                await self.run_pdf_task(
+                    run,
+                    cropper.crop,
+                    page_num=page_num,
+                    coordinates=element["bounding_box"],
+                    page_size=page["metadata"]["size"],
+                    output_file=output_file,
+                )
+            else:
+                page["text"] += element["text"]
+
+        return [page]
+
+    async def summarize_page(self, page, run):
+        page_summary = await run["page_summary_chain"].ainvoke(
+            {"context": [Document(page_content=page["text"])]}
+        )
+        page["page_summary"] = page_summary
+
+        image_batches = [
+            {"image": path, "text": page_summary, "page": page["page_num"],
+             "id": key, "language": run["language"]}
+            for key, path in page["image_paths"].items()
+        ]
+        table_batches = [
+            {"table": path, "text": page_summary, "page": page["page_num"],
+             "id": key, "language": run["language"]}
+            for key, path in page["table_paths"].items()
+        ]
+
+        async def extract(chain, batches):
+            return await chain.ainvoke(batches) if batches else []
+
+        image_summaries, table_summaries, table_markdowns = await asyncio.gather(
+            extract(extract_image_summary, image_batches),
+            extract(extract_table_summary, table_batches),
+            extract(table_markdown_extractor, table_batches),
+        )
+
+        page["image_summaries"] = dict(zip(page["image_paths"], image_summaries))
+        page["table_summaries"] = dict(zip(page["table_paths"], table_summaries))
+        page["table_markdowns"] = dict(zip(page["table_paths"], table_markdowns))
+        page["table_summary_batches"] = table_batches
+
+        run["page_latency"][page["page_num"]] = round(time.perf_counter() - run["start_time"], 3)
+        run["pages"][page["page_num"]] = page
+        return []
+
+    def write_json(self, json_file_path, json_data):
+        with open(json_file_path, "w") as f:
+            json.dump(json_data, f, ensure_ascii=False, indent=4)
+
+    def load_previous_request_info(self, state):
+        analyze_request_info_path = state["file_paths"]["analyze_request_info"]
+        if not os.path.exists(analyze_request_info_path):
+            return {}
+        with open(analyze_request_info_path, "r") as f:
+            return json.load(f)
+
+    def save_submitted_request(self, run, file_path, request_id, content_hash):
+        run["analysis_request_info"][file_path] = {
+            "splitted_file_path": file_path,
+            "request_id": request_id,
+            "analyzed_json_file_path": None,
+            "content_hash": content_hash,
+        }
+        self.save_request_info(run)
+
+    def save_request_info(self, run):
+        analysis_request_info = dict(run["previous_request_info"])
+        analysis_request_info.update(run["analysis_request_info"])
+        with open(run["request_info_path"], "w") as f:
+            json.dump(analysis_request_info, f, indent=4)
+
+    def finalize(self, state, run):
+        pages = [run["pages"][page_num] for page_num in sorted(run["pages"])]
+
+        element_keys = sorted(
+            element["id"] for page in pages for element in page["elements"]
+        )
+        element_ids = {key: element_id for element_id, key in enumerate(element_keys)}
+
+        def rename(paths, subdir):
+            renamed = dict()
+            for key, path in paths.items():
+                output_file = run["processed_dir"] / subdir / f"{element_ids[key]}.png"
+                os.replace(path, output_file)
+                renamed[element_ids[key]] = output_file
+            return renamed
+
+        result = {
+            "page_metadata": dict(),
+            "page_elements": dict(),
+            "image_paths": dict(),
+            "table_paths": dict(),
+            "texts": dict(),
+            "page_summaries": dict(),
+            "image_summaries": dict(),
+            "table_summaries": dict(),
+            "table_markdowns": dict(),
+            "table_summary_batches": [],
+        }
+
+        for page in pages:
+            page_num = page["page_num"]
+            for element in page["elements"]:
+                element["id"] = element_ids[element["id"]]
+
+            if page["metadata"] is None:
+                result["page_elements"][page_num] = page["elements"]
+                continue
+
+            image_paths = rename(page["image_paths"], "figures")
+            table_paths = rename(page["table_paths"], "tables")
+
+            for batch in page["table_summary_batches"]:
+                batch["id"] = element_ids[batch["id"]]
+                batch["table"] = table_paths[batch["id"]]
+
+            result["page_metadata"][page_num] = page["metadata"]
+            if page["elements"]:
+                result["page_elements"][page_num] = page["elements"]
+            result["image_paths"].update(image_paths)
+            result["table_paths"].update(table_paths)
+            result["texts"][page_num] = page["text"]
+            result["page_summaries"][page_num] = page["page_summary"]
+            for name in ("image_summaries", "table_summaries", "table_markdowns"):
+                result[name].update(
+                    {element_ids[key]: value for key, value in page[name].items()}
+                )
+            result["table_summary_batches"].extend(page["table_summary_batches"])
+
+        result["page_elements"] = self.elements_node.extract_tag_elements_per_page(
+            result["page_elements"]
+        )
+        return result
+
+    async def aexecute(self, state: FileState) -> FileState:
+        splitted_file_buffers = dict()
+        run = {
+            "start_time": time.perf_counter(),
+            "processed_dir": Path(state["file_paths"]["processed_dir"]),
+            "language": state["language"],
+            "splitted_file_paths": [],
+            "splitted_file_buffers": splitted_file_buffers,
+            "request_info_path": state["file_paths"]["analyze_request_info"],
+            "previous_request_info": self.load_previous_request_info(state),
+            "analysis_request_info": dict(),
+            "requester": LayoutAnalyzeRequester(
+                os.environ.get("UPSTAGE_TOKEN"),
+                {"file_paths": state["file_paths"], "splitted_file_paths": [],
+                 "splitted_file_buffers": splitted_file_buffers},
+                max_concurrency=self.layout_concurrency,
+            ),
+            "layout_cache": self.layout_node.create_cache(),
+            "page_summary_chain": self.page_summary_node.create_page_summary_chain(),
+            "page_latency": dict(),
+            "pages": dict(),
+            "crop_paths": [],
+        }
+
+        split_queue = asyncio.Queue(maxsize=self.queue_size)
+        page_queue = asyncio.Queue(maxsize=self.queue_size)
+        summary_queue = asyncio.Queue(maxsize=self.queue_size)
+        done_queue = asyncio.Queue()
+
+        run["pdf_executor"] = ThreadPoolExecutor(max_workers=1)
+        run["layout_executor"] = (
+            ProcessPoolExecutor(max_workers=self.layout_concurrency)
+            if self.layout_node.backend in ("local", "hybrid") else None
+        )
+        cropper = ClipRegionCropper(state["file_paths"]["original_pdf"], dpi=self.dpi)
+
+        failed = True
+        try:
+            async with run["requester"]:
+                await gather_or_cancel(
+                    self.produce_splits(state, run, split_queue),
+                    self.run_stage(lambda item: self.analyze_layout(item, run),
+                                   split_queue, page_queue, self.layout_concurrency),
+                    self.run_stage(lambda item: self.crop_page(item, run, cropper),
+                                   page_queue, summary_queue),
+                    self.run_stage(lambda item: self.summarize_page(item, run),
+                                   summary_queue, done_queue, self.summary_concurrency),
+                )
+            failed = False
+        finally:
+            await self.run_pdf_task(run, cropper.close)
+            run["pdf_executor"].shutdown()
+            if failed:
+                for crop_path in run["crop_paths"]:
+                    Path(crop_path).unlink(missing_ok=True)
+            if run["layout_executor"] is not None:
+                run["layout_executor"].shutdown()
+
+        self.save_request_info(run)
+        result = self.finalize(state, run)
+
+        layout_cache_stats = dict()
+        if run["layout_cache"] is not None:
+            layout_cache_stats = {**run["layout_cache"].stats(),
+                                  "evicted": run["layout_cache"].evict()}
+
+        self.log("StreamingIngestionNode execution completed",
+                 num_total_page=run["num_total_page"],
+                 num_processed_page=sum(page["metadata"] is not None for page in run["pages"].values()),
+                 num_total_image=len(result["image_paths"]),
+                 num_total_table=len(result["table_paths"]),
+                 total_seconds=round(time.perf_counter() - run["start_time"], 3),
+                 layout_cache=layout_cache_stats,
+                 llm_cache=llm_cache_stats(),
+                 page_latency=run["page_latency"])
+
+        return FileState(
+            split_size=self.batch_size,
+            num_total_page=run["num_total_page"],
+            splitted_file_paths=run["splitted_file_paths"],
+            analysis_request_info={
+                path: run["analysis_request_info"][path]
+                for path in run["splitted_file_paths"]
+                if path in run["analysis_request_info"]
+            },
+            **result,
+        )
+
+    def execute(self, state: FileState) -> FileState:
+        return run_sync(self.aexecute(state))
@@ -1,21 +1,46 @@
-from langchain_openai import ChatOpenAI
+import re
+import asyncio
 from langchain_core.documents import Document
 from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
 from langchain.chains.combine_documents import create_stuff_documents_chain
 
 from ingestion.chains.summary import (
     extract_image_summary,
     extract_table_summary,  
+    extract_table_summary_and_markdown,
+    table_markdown_extractor,
+    format_table_summary,
+    estimate_table_extraction_cost,
 )
 from ingestion.states import FileState
 from ingestion.nodes.base import BaseNode
+from ingestion.models.chat import create_chat_model
+from ingestion.utils.llm_cache import llm_cache_stats
+from ingestion.utils.image_preparer import get_image_preparer
+from ingestion.utils.llm_scheduler import (
+    PRIORITY_PAGE_SUMMARY,
+    estimate_text_tokens,
+    get_llm_scheduler,
+)
+
+
+PACKED_PAGE_PATTERN = re.compile(r'<page number="(\d+)">(.*?)</page>', re.DOTALL)
 
 
 class PageSummaryNode(BaseNode):
-    def __init__(self, api_key, **kwargs):
+    outputs = ("page_summaries",)
+
+    def __init__(self, api_key, pack_pages=False, short_page_chars=200, min_page_chars=20,
+                 max_pack_tokens=2000, max_pack_pages=10, **kwargs):
         super().__init__(**kwargs)
         self.name = self.__class__.__name__
         self.api_key = api_key
+        self.pack_pages = pack_pages
+        self.short_page_chars = short_page_chars
+        self.min_page_chars = min_page_chars
+        self.max_pack_tokens = max_pack_tokens
+        self.max_pack_pages = max_pack_pages
 
     def create_page_summary_chain(self):
         prompt = PromptTemplate.from_template(
@@ -35,40 +60,160 @@ class PageSummaryNode(BaseNode):
         """
         )
 
-        llm = ChatOpenAI(
-            model_name="gpt-4o-mini",
-            temperature=0,
-            api_key=self.api_key,
-        )
+        llm = create_chat_model("page_summary",
+                                priority=PRIORITY_PAGE_SUMMARY,
+                                api_key=self.api_key)
 
         page_text_summary_chain = create_stuff_documents_chain(llm, prompt)
         return page_text_summary_chain
 
-    def execute(self, state: FileState) -> FileState:
-        texts = state["texts"]
+    def create_packed_page_summary_chain(self):
+        prompt = PromptTemplate.from_template(
+            """Please summarize EACH page below separately according to the following REQUEST.
 
-        page_summaries = dict()
+        REQUEST:
+        1. Summarize the main points of each page in bullet points.
+        2. Write the summary in same language as the context.
+        3. DO NOT translate any technical terms.
+        4. DO NOT include any unnecessary information.
+        5. Summary must include important entities, numerical values.
+        6. Wrap each summary in <page number="N"></page> using the page number of its page.
+        7. DO NOT merge pages and DO NOT skip any page.
+
+        PAGES:
+        {context}
 
-        sorted_texts = sorted(texts.items(), key=lambda x: x[0])
+        SUMMARIES:
+        """
+        )
 
-        inputs = [
-            {"context": [Document(page_content=text)]}
-            for page_num, text in sorted_texts
+        llm = create_chat_model("page_summary_packed",
+                                priority=PRIORITY_PAGE_SUMMARY,
+                                api_key=self.api_key)
+
+        return prompt | llm | StrOutputParser()
+
+    def plan_page_requests(self, texts: dict[int, str]):
+        empty_pages = dict()
+        single_pages = []
+        packs = []
+        pack, pack_tokens = [], 0
+
+        def close_pack():
+            if len(pack) == 1:
+                single_pages.append(pack[0])
+            elif pack:
+                packs.append(list(pack))
+            pack.clear()
+
+        for page_num, text in sorted(texts.items()):
+            text = text.strip()
+            if self.pack_pages and len(text) < self.min_page_chars:
+                empty_pages[page_num] = text
+                continue
+
+            if not self.pack_pages or len(text) >= self.short_page_chars:
+                close_pack()
+                pack_tokens = 0
+                single_pages.append(page_num)
+                continue
+
+            tokens = estimate_text_tokens(text)
+            if pack and (pack_tokens + tokens > self.max_pack_tokens
+                         or len(pack) >= self.max_pack_pages):
+                close_pack()
+                pack_tokens = 0
+            pack.append(page_num)
+            pack_tokens += tokens
+        close_pack()
+
+        return empty_pages, single_pages, packs
+
+    def create_inputs(self, state: FileState, page_numbers):
+        return [
+            {"context": [Document(page_content=state["texts"][page_num])]}
+            for page_num in page_numbers
         ]
-        text_summary_chain = self.create_page_summary_chain()
 
-        summaries = text_summary_chain.batch(inputs)
+    def create_packed_inputs(self, state: FileState, packs):
+        return [
+            {"context": "\n\n".join(
+                f'<page number="{page_num}">\n{state["texts"][page_num].strip()}\n</page>'
+                for page_num in pack
+            )}
+            for pack in packs
+        ]
+
+    def parse_packed_summaries(self, packs, outputs):
+        page_summaries = dict()
+        for pack, output in zip(packs, outputs):
+            for page_num, summary in PACKED_PAGE_PATTERN.findall(output):
+                if int(page_num) in pack and summary.strip():
+                    page_summaries[int(page_num)] = summary.strip()
+        return page_summaries
+
+    def create_result(self, page_summaries, empty_pages, single_pages, packs,
+                      fallback_pages) -> FileState:
+        page_summaries = dict(sorted(page_summaries.items()))
 
-        for page_num, summary in enumerate(summaries):
-            page_summaries[page_num] = summary
-        
         self.log("PageSummaryNode execution completed",
-                 page_summaries=page_summaries)
+                 page_summaries=page_summaries,
+                 num_llm_requests=len(single_pages) + len(packs) + len(fallback_pages),
+                 num_skipped_pages=len(empty_pages),
+                 num_packed_pages=sum(len(pack) for pack in packs),
+                 num_fallback_pages=len(fallback_pages),
+                 llm_cache={namespace: llm_cache_stats(namespace)
+                            for namespace in ("page_summary", "page_summary_packed")},
+                 llm_scheduler=get_llm_scheduler().stats())
         
         return FileState(page_summaries=page_summaries)
+
+    def execute(self, state: FileState) -> FileState:
+        empty_pages, single_pages, packs = self.plan_page_requests(state["texts"])
+        text_summary_chain = self.create_page_summary_chain()
+
+        page_summaries = dict(empty_pages)
+        summaries = text_summary_chain.batch(self.create_inputs(state, single_pages))
+        page_summaries.update(zip(single_pages, summaries))
+
+        fallback_pages = []
+        if packs:
+            outputs = self.create_packed_page_summary_chain().batch(
+                self.create_packed_inputs(state, packs)
+            )
+            page_summaries.update(self.parse_packed_summaries(packs, outputs))
+            fallback_pages = [page_num for pack in packs for page_num in pack
+                              if page_num not in page_summaries]
+            summaries = text_summary_chain.batch(self.create_inputs(state, fallback_pages))
+            page_summaries.update(zip(fallback_pages, summaries))
+
+        return self.create_result(page_summaries, empty_pages, single_pages, packs, fallback_pages)
+
+    async def aexecute(self, state: FileState) -> FileState:
+        empty_pages, single_pages, packs = self.plan_page_requests(state["texts"])
+        text_summary_chain = self.create_page_summary_chain()
+
+        page_summaries = dict(empty_pages)
+        summaries, outputs = await asyncio.gather(
+            text_summary_chain.abatch(self.create_inputs(state, single_pages)),
+            self.create_packed_page_summary_chain().abatch(
+                self.create_packed_inputs(state, packs)
+            ),
+        )
+        page_summaries.update(zip(single_pages, summaries))
+        page_summaries.update(self.parse_packed_summaries(packs, outputs))
+
+        fallback_pages = [page_num for pack in packs for page_num in pack
+                          if page_num not in page_summaries]
+        summaries = await text_summary_chain.abatch(self.create_inputs(state, fallback_pages))
+        page_summaries.update(zip(fallback_pages, summaries))
+
+        return self.create_result(page_summaries, empty_pages, single_pages, packs, fallback_pages)
     
 
 class ImageSummaryNode(BaseNode):
+    outputs = ("image_summaries",)
+
     def __init__(self, api_key, **kwargs):
         super().__init__(**kwargs)
         self.name = "CreateImageSummaryNode"
@@ -77,12 +222,16 @@ class ImageSummaryNode(BaseNode):
     def create_image_summary_data_batches(self, state: FileState):
         data_batches = []
 
+        image_groups = state.get("image_groups")
+
         page_numbers = sorted(list(state["page_elements"].keys()))
 
         for page_num in page_numbers:
             text = state["page_summaries"][page_num]
             for image_element in state["page_elements"][page_num]["figure_elements"]:
                 image_id = int(image_element["id"])
+                if image_groups is not None and image_id not in image_groups:
+                    continue
 
                 data_batches.append(
                     {
@@ -95,27 +244,54 @@ class ImageSummaryNode(BaseNode):
                 )
         return data_batches
 
-    def execute(self, state: FileState):
-        image_summary_data_batches = self.create_image_summary_data_batches(state)
-        image_summaries = extract_image_summary.invoke(
-            image_summary_data_batches,
-        )
-
+    def create_result(self, state: FileState, image_summary_data_batches,
+                      image_summaries) -> FileState:
+        image_groups = state.get("image_groups") or dict()
         image_summary_output = dict()
 
         for data_batch, image_summary in zip(
             image_summary_data_batches, image_summaries
         ):
-            image_summary_output[data_batch["id"]] = image_summary
+            for image_id in image_groups.get(data_batch["id"], [data_batch["id"]]):
+                image_summary_output[image_id] = image_summary
+
+        self.log("ImageSummaryNode execution completed",
+                 num_total_image=len(image_summary_output),
+                 num_summarized_image=len(image_summary_data_batches),
+                 saved_calls=len(image_summary_output) - len(image_summary_data_batches),
+                 image_payload=get_image_preparer().payload_stats(
+                     [data_batch["image"] for data_batch in image_summary_data_batches]
+                 ),
+                 llm_cache=llm_cache_stats("image_summary"),
+                 llm_scheduler=get_llm_scheduler().stats())
 
         return FileState(image_summaries=image_summary_output)
 
+    def execute(self, state: FileState):
+        image_summary_data_batches = self.create_image_summary_data_batches(state)
+        image_summaries = extract_image_summary.invoke(
+            image_summary_data_batches,
+        )
+        return self.create_result(state, image_summary_data_batches, image_summaries)
+
+    async def aexecute(self, state: FileState):
+        image_summary_data_batches = self.create_image_summary_data_batches(state)
+        image_summaries = await extract_image_summary.ainvoke(
+            image_summary_data_batches,
+        )
+        return self.create_result(state, image_summary_data_batches, image_summaries)
+
 
 class TableSummaryNode(BaseNode):
-    def __init__(self, api_key, **kwargs):
+    outputs = ("table_summaries", "table_summary_batches")
+
+    def __init__(self, api_key, combined_markdown=False, **kwargs):
         super().__init__(**kwargs)
         self.name = "CreateTableSummaryNode"
         self.api_key = api_key
+        self.combined_markdown = combined_markdown
+        if combined_markdown:
+            self.outputs = (*self.outputs, "table_markdowns")
 
     def create_table_summary_data_batches(self, state: FileState):
         data_batches = []
@@ -138,12 +314,7 @@ class TableSummaryNode(BaseNode):
                 )
         return data_batches
 
-    def execute(self, state: FileState):
-        table_summary_data_batches = self.create_table_summary_data_batches(state)
-        table_summaries = extract_table_summary.invoke(
-            table_summary_data_batches,
-        )
-
+    def create_result(self, table_summary_data_batches, table_summaries) -> FileState:
         table_summary_output = dict()
 
         for data_batch, table_summary in zip(
@@ -151,7 +322,99 @@ class TableSummaryNode(BaseNode):
         ):
             table_summary_output[data_batch["id"]] = table_summary
 
+        self.log("TableSummaryNode execution completed",
+                 num_total_table=len(table_summary_output),
+                 image_payload=get_image_preparer().payload_stats(
+                     [data_batch["table"] for data_batch in table_summary_data_batches]
+                 ),
+                 llm_cache=llm_cache_stats("table_summary"),
+                 llm_scheduler=get_llm_scheduler().stats())
+
         return FileState(
             table_summaries=table_summary_output,
             table_summary_batches=table_summary_data_batches,
-        )
\ No newline at end of file
+        )
+
+    def create_combined_result(self, table_summary_data_batches, extractions,
+                               fallback_data_batches, fallback_summaries, fallback_markdowns):
+        table_summary_output = dict()
+        table_markdown_output = dict()
+
+        for data_batch, extraction in zip(table_summary_data_batches, extractions):
+            if extraction is not None:
+                table_summary_output[data_batch["id"]] = format_table_summary(extraction)
+                table_markdown_output[data_batch["id"]] = extraction.markdown
+
+        for data_batch, table_summary, table_markdown in zip(
+            fallback_data_batches, fallback_summaries, fallback_markdowns
+        ):
+            table_summary_output[data_batch["id"]] = table_summary
+            table_markdown_output[data_batch["id"]] = table_markdown
+
+        self.log("TableSummaryNode execution completed",
+                 num_total_table=len(table_summary_output),
+                 num_fallback_table=len(fallback_data_batches),
+                 image_payload=get_image_preparer().payload_stats(
+                     [data_batch["table"] for data_batch in table_summary_data_batches]
+                 ),
+                 llm_calls=len(table_summary_data_batches) + 2 * len(fallback_data_batches),
+                 estimated_cost=(estimate_table_extraction_cost(table_summary_data_batches)
+                                 if self.verbose else None),
+                 llm_cache=llm_cache_stats(),
+                 llm_scheduler=get_llm_scheduler().stats())
+
+        return FileState(
+            table_summaries={key: table_summary_output[key] for key in sorted(table_summary_output)},
+            table_markdowns={key: table_markdown_output[key] for key in sorted(table_markdown_output)},
+            table_summary_batches=table_summary_data_batches,
+        )
+
+    def execute_combined(self, table_summary_data_batches):
+        extractions = extract_table_summary_and_markdown.invoke(table_summary_data_batches)
+        fallback_data_batches = [data_batch for data_batch, extraction
+                                 in zip(table_summary_data_batches, extractions)
+                                 if extraction is None]
+
+        fallback_summaries, fallback_markdowns = [], []
+        if fallback_data_batches:
+            fallback_summaries = extract_table_summary.invoke(fallback_data_batches)
+            fallback_markdowns = table_markdown_extractor.invoke(fallback_data_batches)
+
+        return self.create_combined_result(table_summary_data_batches, extractions,
+                                           fallback_data_batches, fallback_summaries,
+                                           fallback_markdowns)
+
+    async def aexecute_combined(self, table_summary_data_batches):
+        extractions = await extract_table_summary_and_markdown.ainvoke(table_summary_data_batches)
+        fallback_data_batches = [data_batch for data_batch, extraction
+                                 in zip(table_summary_data_batches, extractions)
+                                 if extraction is None]
+
+        fallback_summaries, fallback_markdowns = [], []
+        if fallback_data_batches:
+            fallback_summaries, fallback_markdowns = await asyncio.gather(
+                extract_table_summary.ainvoke(fallback_data_batches),
+                table_markdown_extractor.ainvoke(fallback_data_batches),
+            )
+
+        return self.create_combined_result(table_summary_data_batches, extractions,
+                                           fallback_data_batches, fallback_summaries,
+                                           fallback_markdowns)
+
+    def execute(self, state: FileState):
+        table_summary_data_batches = self.create_table_summary_data_batches(state)
+        if self.combined_markdown:
+            return self.execute_combined(table_summary_data_batches)
+        table_summaries = extract_table_summary.invoke(
+            table_summary_data_batches,
+        )
+        return self.create_result(table_summary_data_batches, table_summaries)
+
+    async def aexecute(self, state: FileState):
+        table_summary_data_batches = self.create_table_summary_data_batches(state)
+        if self.combined_markdown:
+            return await self.aexecute_combined(table_summary_data_batches)
+        table_summaries = await extract_table_summary.ainvoke(
+            table_summary_data_batches,
+        )
+        return self.create_result(table_summary_data_batches, table_summaries)
@@ -1,28 +1,138 @@
-from langchain.vectorstores import FAISS
+import asyncio
+from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
-from langchain.retrievers import BM25Retriever, EnsembleRetriever
+from langchain_core.documents import Document
+from pydantic import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
 
+from ingestion.utils.bm25 import BM25Index
 from ingestion.utils.document_processor import clean_retrieved_documents
+from ingestion.utils.embedding_cache import CachedEmbeddings
+from ingestion.utils.rank_fusion import RRF_K, fuse_rankings
+from ingestion.utils.retriever_index import build_index, load_index
+from ingestion.utils.vector_index import create_vector_index
 
-def get_retriever(target_docs):
-    bm25_retriever = BM25Retriever.from_documents(
-        target_docs,
+RETRIEVER_NAMES = ("bm25", "dense")
+
+
+# Runs BM25 and FAISS search concurrently over the same docs and fuses their rankings
+# by integer doc id. Dense scores are negated L2 distances for L2 indexes.
+# Like EnsembleRetriever, each side returns k docs and the whole fused union is kept
+# unless top_n caps it.
+class HybridRetriever(BaseRetriever):
+    bm25_index: Any
+    vector_index: Any
+    embedding: Any
+    docs: list[Document]
+    k: int = 5
+    top_n: int | None = None
+    weights: tuple[float, float] = (0.7, 0.3)
+    fusion: str = "rrf"
+    c: int = RRF_K
+    include_scores: bool = True
+
+    _executor: ThreadPoolExecutor = PrivateAttr(
+        default_factory=lambda: ThreadPoolExecutor(max_workers=1, thread_name_prefix="bm25")
     )
-    bm25_retriever.k = 5
+
+    @classmethod
+    def from_documents(cls, docs, embedding, bm25_params=None, vector_index_params=None, **kwargs):
+        docs = list(docs)
+        texts = [doc.page_content for doc in docs]
+        vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        vector_index, _ = create_vector_index(vectors, **(vector_index_params or {}))
+        return cls(bm25_index=BM25Index.from_texts(texts, **(bm25_params or {})),
+                   vector_index=vector_index, embedding=embedding, docs=docs, **kwargs)
+
+    def lexical_search(self, query: str):
+        return self.bm25_index.search(query, self.k)
+
+    def vector_search(self, vector):
+        distances, ids = self.vector_index.search(np.asarray([vector], dtype=np.float32), self.k)
+        found = ids[0] >= 0
+        scores = distances[0][found]
+        if self.vector_index.metric_type == faiss.METRIC_L2:
+            scores = -scores
+        return ids[0][found], scores
+
+    def search(self, query: str):
+        lexical = self._executor.submit(self.lexical_search, query)
+        dense = self.vector_search(self.embedding.embed_query(query))
+        return self.fuse([lexical.result(), dense])
+
+    async def asearch(self, query: str):
+        async def dense():
+            vector = await self.embedding.aembed_query(query)
+            return await asyncio.to_thread(self.vector_search, vector)
+
+        rankings = await asyncio.gather(asyncio.to_thread(self.lexical_search, query), dense())
+        return self.fuse(rankings)
+
+    def fuse(self, rankings):
+        doc_ids, fused, per_retriever = fuse_rankings(rankings, self.weights,
+                                                      method=self.fusion, c=self.c)
+        return doc_ids[:self.top_n], fused[:self.top_n], per_retriever[:self.top_n]
+
+    def create_documents(self, doc_ids, fused, per_retriever) -> list[Document]:
+        if not self.include_scores:
+            return [self.docs[doc_id] for doc_id in doc_ids]
+
+        documents = []
+        for doc_id, fused_score, scores in zip(doc_ids, fused, per_retriever):
+            doc = self.docs[doc_id]
+            retrieval_scores = {name: None if np.isnan(score) else float(score)
+                                for name, score in zip(RETRIEVER_NAMES, scores)}
+            retrieval_scores["fused"] = float(fused_score)
+            documents.append(Document(page_content=doc.page_content,
+                                      metadata={**doc.metadata, "retrieval_scores": retrieval_scores}))
+        return documents
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        return self.create_documents(*self.search(query))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        return self.create_documents(*await self.asearch(query))
+
+
+def get_retriever(target_docs, index_dir=None, vector_index_params=None):
+    if index_dir is not None:
+        build_retriever_index(target_docs, index_dir, vector_index_params=vector_index_params)
+        return load_retriever(index_dir)
 
     embedding = OpenAIEmbeddings()
 
-    faiss_vectorstore = FAISS.from_documents(
+    return HybridRetriever.from_documents(
         target_docs,
         embedding,
+        vector_index_params=vector_index_params,
     )
-    faiss_retriever = faiss_vectorstore.as_retriever(search_kwargs={"k": 5})
 
-    ensemble_retriever = EnsembleRetriever(
-        retrievers=[bm25_retriever, faiss_retriever],
-        weights=[0.7, 0.3],
-    )
-    return ensemble_retriever
+
+def build_retriever_index(target_docs, index_dir, embedding=None, embedding_cache_dir=None,
+                          vector_index_params=None, force=False):
+    embedding = embedding or OpenAIEmbeddings()
+    if embedding_cache_dir is not None:
+        embedding = CachedEmbeddings(embedding, embedding_cache_dir)
+    return build_index(target_docs, index_dir, embedding,
+                       vector_index_params=vector_index_params, force=force)
+
+
+def load_retriever(index_dir, embedding=None, k=5, weights=(0.7, 0.3), mmap=True,
+                   nprobe=None, ef_search=None, **kwargs):
+    manifest, index, bm25, docs = load_index(index_dir, mmap=mmap, nprobe=nprobe,
+                                             ef_search=ef_search)
+
+    embedding = embedding or OpenAIEmbeddings(model=manifest["embedding_model"])
+    if getattr(embedding, "model", manifest["embedding_model"]) != manifest["embedding_model"]:
+        raise ValueError(f"Retriever index was built with {manifest['embedding_model']}, "
+                         f"got {embedding.model}")
+
+    return HybridRetriever(bm25_index=bm25, vector_index=index, embedding=embedding, docs=docs,
+                           k=k, weights=weights, **kwargs)
 
 
 def retrieve_and_check(question, 
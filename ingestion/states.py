@@ -1,18 +1,28 @@
-from typing import TypedDict
+from typing import Annotated, TypedDict
+
+from ingestion.utils.element_store import ElementStore
+
+
+def merge_fingerprints(left: dict[str, str] | None, right: dict[str, str] | None) -> dict[str, str]:
+    return {**(left or {}), **(right or {})}
 
 
 class FileState(TypedDict):
     file_paths: dict[str, str]
     file_basename: str
     file_type: str
+    source_hash: str
+    node_fingerprints: Annotated[dict[str, str], merge_fingerprints]
     num_total_page: int
     split_size: int
     splitted_file_paths: list[str]
     analysis_request_info: list[dict]
+    page_routes: dict[int, str]
     page_metadata: dict[int, dict]
-    page_elements: dict[int, dict[str, list[dict]]]
+    page_elements: dict[int, dict[str, list[dict]]] | ElementStore
     page_summaries: dict[int, str]
     image_paths: dict[int, str]
+    image_groups: dict[int, list[int]]
     image_summaries: dict[int, str]
     table_paths: dict[int, str]
     table_summaries: dict[int, str]
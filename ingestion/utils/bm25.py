@@ -0,0 +1,206 @@
+import re
+import json
+import unicodedata
+from pathlib import Path
+from collections import Counter
+
+import numpy as np
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+NGRAM_RANGE = (2, 3)
+
+# Fraction of the corpus a query may touch before scoring switches to a dense array.
+SPARSE_SCORING_RATIO = 0.1
+
+# Hangul runs and other word runs are split apart, so "2024년" yields "2024" and "년".
+WORD_PATTERN = re.compile(r"[가-힣]+|[^\W가-힣]+", re.UNICODE)
+HANGUL_PATTERN = re.compile(r"[가-힣]")
+
+
+def whitespace_tokenizer(text: str) -> list[str]:
+    return text.split()
+
+
+def char_ngram_tokenizer(text: str, ngram_range=NGRAM_RANGE) -> list[str]:
+    min_n, max_n = ngram_range
+    tokens = []
+    for word in WORD_PATTERN.findall(unicodedata.normalize("NFC", text).lower()):
+        if not HANGUL_PATTERN.search(word) or len(word) <= min_n:
+            tokens.append(word)
+            continue
+        for n in range(min_n, max_n + 1):
+            tokens.extend(word[i:i + n] for i in range(len(word) - n + 1))
+    return tokens
+
+
+TOKENIZERS = {
+    "whitespace": whitespace_tokenizer,
+    "char_ngram": char_ngram_tokenizer,
+}
+
+
+def get_tokenizer(name: str, **params):
+    if name not in TOKENIZERS:
+        raise ValueError(f"Invalid BM25 tokenizer: {name}")
+    tokenizer = TOKENIZERS[name]
+    if params:
+        return lambda text: tokenizer(text, **params)
+    return tokenizer
+
+
+class BM25Index:
+    def __init__(self, vocabulary, indptr, doc_ids, weights, idf, doc_len,
+                 tokenizer="char_ngram", tokenizer_params=None,
+                 k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.idf = idf
+        self.doc_len = doc_len
+        self.tokenizer_name = tokenizer
+        self.tokenizer_params = tokenizer_params or {}
+        self.tokenize = get_tokenizer(tokenizer, **self.tokenizer_params)
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def from_texts(cls, texts, tokenizer="char_ngram", tokenizer_params=None,
+                   k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON):
+        tokenize = get_tokenizer(tokenizer, **(tokenizer_params or {}))
+        vocabulary = dict()
+        term_ids, doc_ids, term_freqs = [], [], []
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len[doc_id] = len(tokens)
+            for term, freq in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        term_freqs = np.asarray(term_freqs, dtype=np.float32)[order]
+
+        doc_freqs = np.bincount(term_ids, minlength=len(vocabulary))
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=indptr[1:])
+
+        # Same idf as rank_bm25.BM25Okapi: negative values are floored to epsilon * mean idf.
+        num_docs = len(texts)
+        idf = np.log((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        if len(idf):
+            idf[idf < 0] = epsilon * float(idf.mean())
+
+        avgdl = float(doc_len.mean()) if num_docs else 0.0
+        norm = k1 * (1 - b + b * doc_len[doc_ids] / (avgdl or 1.0))
+        weights = (term_freqs * (k1 + 1) / (term_freqs + norm)).astype(np.float32)
+
+        return cls(vocabulary, indptr, doc_ids, weights, idf, doc_len,
+                   tokenizer=tokenizer, tokenizer_params=tokenizer_params,
+                   k1=k1, b=b, epsilon=epsilon)
+
+    def query_terms(self, query: str) -> list[tuple[int, int]]:
+        counts = Counter(self.tokenize(query))
+        return [(self.vocabulary[term], count) for term, count in counts.items()
+                if term in self.vocabulary]
+
+    def get_scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term_id, count in self.query_terms(query):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            scores[self.doc_ids[start:end]] += count * self.idf[term_id] * self.weights[start:end]
+        return scores
+
+    # Like BM25Retriever, always returns min(k, num_docs) docs: when fewer than k docs
+    # match, the rest are zero-score docs in doc order. positive_only keeps matches only.
+    def search(self, query: str, k: int = 4,
+               positive_only: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        k = min(k, self.num_docs)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        terms = self.query_terms(query)
+        num_postings = sum(int(self.indptr[term_id + 1] - self.indptr[term_id])
+                           for term_id, _ in terms)
+        if not terms:
+            candidates = np.empty(0, dtype=np.int64)
+            scores = np.empty(0, dtype=np.float32)
+        elif num_postings > SPARSE_SCORING_RATIO * self.num_docs:
+            candidates = np.arange(self.num_docs)
+            scores = self.get_scores(query)
+        else:
+            postings = [(self.doc_ids[self.indptr[term_id]:self.indptr[term_id + 1]],
+                         count * self.idf[term_id]
+                         * self.weights[self.indptr[term_id]:self.indptr[term_id + 1]])
+                        for term_id, count in terms]
+            candidates, inverse = np.unique(np.concatenate([ids for ids, _ in postings]),
+                                            return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate([w for _, w in postings]),
+                                 minlength=len(candidates)).astype(np.float32)
+
+        if len(scores) > k:
+            matched = np.argpartition(-scores, k - 1)[:k]
+        else:
+            matched = np.arange(len(scores))
+        matched = matched[scores[matched] > 0]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        doc_ids = candidates[matched].astype(np.int64)
+        doc_scores = scores[matched]
+        if positive_only or len(doc_ids) == k:
+            return doc_ids, doc_scores
+
+        padding = np.setdiff1d(np.arange(k + len(doc_ids)), doc_ids)[:k - len(doc_ids)]
+        return (np.concatenate([doc_ids, padding]),
+                np.concatenate([doc_scores, np.zeros(len(padding), dtype=np.float32)]))
+
+    def save(self, index_dir) -> Path:
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        for name in ("indptr", "doc_ids", "weights", "idf", "doc_len"):
+            np.save(index_dir / f"{name}.npy", getattr(self, name))
+
+        terms = [None] * len(self.vocabulary)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+        with open(index_dir / "vocabulary.json", "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+
+        with open(index_dir / "bm25.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "tokenizer": self.tokenizer_name,
+                "tokenizer_params": self.tokenizer_params,
+                "k1": self.k1,
+                "b": self.b,
+                "epsilon": self.epsilon,
+                "num_docs": self.num_docs,
+                "num_terms": len(self.vocabulary),
+            }, f, ensure_ascii=False, indent=2)
+        return index_dir
+
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        index_dir = Path(index_dir)
+        with open(index_dir / "bm25.json", "r", encoding="utf-8") as f:
+            params = json.load(f)
+        with open(index_dir / "vocabulary.json", "r", encoding="utf-8") as f:
+            vocabulary = {term: term_id for term_id, term in enumerate(json.load(f))}
+
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(index_dir / f"{name}.npy", mmap_mode=mmap_mode)
+                  for name in ("indptr", "doc_ids", "weights", "idf", "doc_len")}
+        return cls(vocabulary,
+                   tokenizer=params["tokenizer"],
+                   tokenizer_params=params["tokenizer_params"],
+                   k1=params["k1"], b=params["b"], epsilon=params["epsilon"],
+                   **arrays)
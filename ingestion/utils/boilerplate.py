@@ -0,0 +1,131 @@
+import re
+from collections import Counter, defaultdict
+
+from ingestion.utils.element_store import ElementStore
+
+BOILERPLATE_CATEGORIES = ("header", "footer")
+MARGIN_RATIO = 0.1
+MIN_PAGE_RATIO = 0.3
+MIN_PAGES = 3
+MAX_BOILERPLATE_CHARS = 200
+
+PAGE_NUMBER_PATTERN = re.compile(
+    r"^(?:page|p\.|페이지)?\s*[-–—(]?\s*(?:\d+|[ivxlcdm]+)\s*[-–—)]?"
+    r"(?:\s*(?:/|of)\s*\d+)?\s*(?:page|쪽|페이지)?$",
+    re.IGNORECASE,
+)
+
+
+def normalize_text(text: str, mask_digits: bool = True) -> str:
+    text = text.lower()
+    if mask_digits:
+        text = re.sub(r"\d+", "#", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def vertical_band(element: dict, page_size, margin_ratio: float = MARGIN_RATIO) -> str:
+    if not page_size or not element.get("bounding_box"):
+        return "body"
+    y_values = [coord["y"] for coord in element["bounding_box"]]
+    center = (min(y_values) + max(y_values)) / 2 / page_size[1]
+    if center <= margin_ratio:
+        return "top"
+    if center >= 1 - margin_ratio:
+        return "bottom"
+    return "body"
+
+
+class BoilerplateDetector:
+    def __init__(self, mode="collapse", margin_ratio=MARGIN_RATIO, min_page_ratio=MIN_PAGE_RATIO,
+                 min_pages=MIN_PAGES, max_chars=MAX_BOILERPLATE_CHARS,
+                 categories=BOILERPLATE_CATEGORIES):
+        if mode not in ("drop", "collapse"):
+            raise ValueError(f"Invalid boilerplate mode: {mode}")
+        self.mode = mode
+        self.margin_ratio = margin_ratio
+        self.min_page_ratio = min_page_ratio
+        self.min_pages = min_pages
+        self.max_chars = max_chars
+        self.categories = categories
+        self.repeated_keys = set()
+
+    def element_key(self, element: dict, page_size) -> tuple[str, str]:
+        # Running headers/footers vary only by numbers (page, chapter); body text must repeat verbatim.
+        band = vertical_band(element, page_size, self.margin_ratio)
+        return band, normalize_text(element.get("text", ""), mask_digits=band != "body")
+
+    def text_elements(self, page_elements: dict):
+        for page_num, page in sorted(page_elements.items()):
+            for element in page["text_elements"]:
+                if element.get("text", "").strip():
+                    yield page_num, element
+
+    def fit(self, page_elements: dict, page_metadata: dict):
+        key_pages = defaultdict(set)
+        for page_num, element in self.text_elements(page_elements):
+            if len(element["text"]) > self.max_chars:
+                continue
+            page_size = page_metadata.get(page_num, {}).get("size")
+            key_pages[self.element_key(element, page_size)].add(page_num)
+
+        min_pages = max(self.min_pages, self.min_page_ratio * len(page_elements))
+        self.repeated_keys = {key for key, pages in key_pages.items() if len(pages) >= min_pages}
+        return self
+
+    def classify(self, element: dict, page_size) -> str | None:
+        text = element.get("text", "").strip()
+        band, normalized_text = self.element_key(element, page_size)
+
+        if element["category"] in self.categories:
+            return "category"
+        if band != "body" and PAGE_NUMBER_PATTERN.match(text):
+            return "page_number"
+        if len(text) <= self.max_chars and (band, normalized_text) in self.repeated_keys:
+            return "repeated"
+        return None
+
+    def filter(self, page_elements: dict, page_metadata: dict):
+        self.fit(page_elements, page_metadata)
+
+        removed = dict()
+        reasons = Counter()
+        seen_keys = set()
+
+        for page_num, page in sorted(page_elements.items()):
+            page_size = page_metadata.get(page_num, {}).get("size")
+            removed_ids = []
+
+            for element in page["text_elements"]:
+                if not element.get("text", "").strip():
+                    continue
+                reason = self.classify(element, page_size)
+                if reason is None:
+                    continue
+
+                key = self.element_key(element, page_size)
+                if self.mode == "collapse" and reason == "repeated" and key not in seen_keys:
+                    seen_keys.add(key)
+                    continue
+
+                removed_ids.append(element["id"])
+                reasons[reason] += 1
+
+            if removed_ids:
+                removed[page_num] = removed_ids
+
+        removed_ids = {element_id for element_ids in removed.values() for element_id in element_ids}
+        if isinstance(page_elements, ElementStore):
+            filtered_page_elements = page_elements.without_ids(removed_ids)
+        else:
+            filtered_page_elements = {
+                page_num: {
+                    **page,
+                    "text_elements": [element for element in page["text_elements"]
+                                      if element["id"] not in removed_ids],
+                    "elements": [element for element in page["elements"]
+                                 if element["id"] not in removed_ids],
+                }
+                for page_num, page in page_elements.items()
+            }
+
+        return filtered_page_elements, removed, dict(reasons)
@@ -0,0 +1,168 @@
+import os
+import re
+import pickle
+import threading
+from pathlib import Path
+from langchain_core.runnables.config import ensure_config
+from langgraph.checkpoint.memory import MemorySaver
+
+from ingestion import logger
+from ingestion.utils.processed_document import sha256_file
+
+
+class PickleSerializer:
+    def dumps(self, obj) -> bytes:
+        return pickle.dumps(obj)
+
+    def loads(self, data: bytes):
+        return pickle.loads(data)
+
+    def dumps_typed(self, obj) -> tuple[str, bytes]:
+        return "pickle", pickle.dumps(obj)
+
+    def loads_typed(self, data: tuple[str, bytes]):
+        return pickle.loads(data[1])
+
+
+# Each put/put_writes appends only what it added (the checkpoint, its new channel blobs
+# or the task's writes) to a per-thread log, so saving stays O(delta) over a run.
+class DiskCheckpointSaver(MemorySaver):
+    def __init__(self, checkpoint_dir, serde=None, **kwargs):
+        super().__init__(serde=serde or PickleSerializer(), **kwargs)
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+
+        for thread_file in sorted(self.checkpoint_dir.glob("*.pkl")):
+            self.load_thread(thread_file)
+        for log_file in sorted(self.checkpoint_dir.glob("*.log")):
+            self.load_log(log_file)
+
+    def thread_name(self, thread_id) -> str:
+        return re.sub(r"[^\w.-]", "_", str(thread_id))
+
+    def thread_file(self, thread_id) -> Path:
+        return self.checkpoint_dir / (self.thread_name(thread_id) + ".pkl")
+
+    def log_file(self, thread_id) -> Path:
+        return self.checkpoint_dir / (self.thread_name(thread_id) + ".log")
+
+    # Snapshot files written by earlier versions of this saver.
+    def load_thread(self, thread_file):
+        try:
+            with open(thread_file, "rb") as f:
+                snapshot = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.error(f"Failed to load checkpoint file {thread_file}: {e}")
+            return
+
+        thread_id = snapshot["thread_id"]
+        for checkpoint_ns, checkpoints in snapshot["storage"].items():
+            self.storage[thread_id][checkpoint_ns].update(checkpoints)
+        for key, writes in snapshot["writes"].items():
+            self.writes[key] = writes
+        if getattr(self, "blobs", None) is not None:
+            self.blobs.update(snapshot.get("blobs", {}))
+
+    def load_log(self, log_file):
+        valid_size = 0
+        with open(log_file, "rb") as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception as e:
+                    logger.error(f"Truncating torn checkpoint record in {log_file}: {e}")
+                    break
+                self.apply_record(record)
+                valid_size = f.tell()
+
+        if log_file.stat().st_size != valid_size:
+            os.truncate(log_file, valid_size)
+
+    def apply_record(self, record):
+        thread_id = record["thread_id"]
+        if record["type"] == "checkpoint":
+            self.storage[thread_id][record["checkpoint_ns"]][record["checkpoint_id"]] = record["checkpoint"]
+            if getattr(self, "blobs", None) is not None:
+                self.blobs.update(record["blobs"])
+        else:
+            self.writes[record["key"]].update(record["writes"])
+
+    def append_record(self, record):
+        with open(self.log_file(record["thread_id"]), "ab") as f:
+            pickle.dump(record, f)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self.lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            blobs = getattr(self, "blobs", {})
+            blob_keys = [(thread_id, checkpoint_ns, channel, version)
+                         for channel, version in new_versions.items()]
+            self.append_record({
+                "type": "checkpoint",
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+                "checkpoint": self.storage[thread_id][checkpoint_ns][checkpoint["id"]],
+                "blobs": {key: blobs[key] for key in blob_keys if key in blobs},
+            })
+        return next_config
+
+    def put_writes(self, config, writes, task_id, *args, **kwargs):
+        with self.lock:
+            super().put_writes(config, writes, task_id, *args, **kwargs)
+            configurable = config["configurable"]
+            key = (configurable["thread_id"], configurable.get("checkpoint_ns", ""),
+                   configurable["checkpoint_id"])
+            self.append_record({
+                "type": "writes",
+                "thread_id": key[0],
+                "key": key,
+                "writes": {inner_key: write for inner_key, write in self.writes[key].items()
+                           if inner_key[0] == task_id},
+            })
+
+    def delete_thread(self, thread_id):
+        with self.lock:
+            self.storage.pop(thread_id, None)
+            for key in [key for key in self.writes if key[0] == thread_id]:
+                del self.writes[key]
+            for key in [key for key in getattr(self, "blobs", {}) if key[0] == thread_id]:
+                del self.blobs[key]
+            self.thread_file(thread_id).unlink(missing_ok=True)
+            self.log_file(thread_id).unlink(missing_ok=True)
+
+
+# An interrupted run is only resumed for the same source PDF; a revised file starts over.
+def can_resume(snapshot, input_state) -> bool:
+    if not snapshot.next:
+        return False
+    source_path = ((input_state or {}).get("file_paths") or {}).get("original_pdf")
+    source_hash = snapshot.values.get("source_hash")
+    if source_path is None or source_hash is None or not os.path.exists(source_path):
+        return True
+    return sha256_file(source_path) == source_hash
+
+
+def invoke_resumable(app, input_state, config):
+    config = ensure_config(config)
+    snapshot = app.get_state(config)
+
+    if can_resume(snapshot, input_state):
+        logger.info(f"Resuming thread {config['configurable']['thread_id']} at {list(snapshot.next)}")
+        return app.invoke(None, config=config)
+    return app.invoke(input_state, config=config)
+
+
+async def ainvoke_resumable(app, input_state, config):
+    config = ensure_config(config)
+    snapshot = await app.aget_state(config)
+
+    if can_resume(snapshot, input_state):
+        logger.info(f"Resuming thread {config['configurable']['thread_id']} at {list(snapshot.next)}")
+        return await app.ainvoke(None, config=config)
+    return await app.ainvoke(input_state, config=config)
@@ -0,0 +1,213 @@
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+ELEMENT_GROUPS = ("figure_elements", "table_elements", "text_elements")
+GROUP_FIGURE, GROUP_TABLE, GROUP_TEXT = range(len(ELEMENT_GROUPS))
+ELEMENT_FIELDS = ("id", "page", "category", "bounding_box", "text")
+
+
+def element_group(category: str) -> int:
+    if category == "figure":
+        return GROUP_FIGURE
+    if category == "table":
+        return GROUP_TABLE
+    return GROUP_TEXT
+
+
+class ElementView(Mapping):
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key):
+        store, index = self.store, self.index
+        if key == "id":
+            return int(store.ids[index])
+        if key == "page":
+            return int(store.pages[index])
+        if key == "category":
+            return store.categories[store.category_codes[index]]
+        if key == "bounding_box":
+            return [{"x": x.item(), "y": y.item()} for x, y in store.bounding_boxes[index]]
+        if key == "text":
+            return store.text_buffer[store.text_offsets[index]:store.text_offsets[index + 1]]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(ELEMENT_FIELDS)
+
+    def __len__(self):
+        return len(ELEMENT_FIELDS)
+
+    def __repr__(self):
+        return f"ElementView({dict(self)!r})"
+
+
+class ElementList(Sequence):
+    __slots__ = ("store", "indices")
+
+    def __init__(self, store, indices):
+        self.store = store
+        self.indices = indices
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return ElementList(self.store, self.indices[position])
+        return ElementView(self.store, int(self.indices[position]))
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"ElementList({list(self)!r})"
+
+
+class PageView(Mapping):
+    __slots__ = ("store", "start", "end")
+
+    def __init__(self, store, start, end):
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __getitem__(self, key):
+        if key == "elements":
+            return ElementList(self.store, np.arange(self.start, self.end))
+        if key in ELEMENT_GROUPS:
+            groups = self.store.groups[self.start:self.end]
+            indices = np.flatnonzero(groups == ELEMENT_GROUPS.index(key)) + self.start
+            return ElementList(self.store, indices)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter((*ELEMENT_GROUPS, "elements"))
+
+    def __len__(self):
+        return len(ELEMENT_GROUPS) + 1
+
+
+def coordinate_array(coordinates) -> np.ndarray:
+    coordinates = np.asarray(coordinates)
+    if coordinates.dtype.kind in "iu" or np.array_equal(coordinates, np.round(coordinates)):
+        return coordinates.astype(np.int32, copy=False)
+    return coordinates.astype(np.float64, copy=False)
+
+
+# Parallel arrays in page order; page and category lookups return index views over them,
+# so each element is stored once. Only ELEMENT_FIELDS are kept. Integral coordinates are
+# stored as int32, others as float64, so reads round-trip exactly.
+class ElementStore(Mapping):
+    __slots__ = ("ids", "pages", "category_codes", "categories", "groups", "bounding_boxes",
+                 "text_offsets", "text_buffer", "page_ranges")
+
+    def __init__(self, ids, pages, category_codes, categories, bounding_boxes,
+                 text_offsets, text_buffer):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.pages = np.asarray(pages, dtype=np.int32)
+        self.category_codes = np.asarray(category_codes, dtype=np.uint8)
+        self.categories = tuple(categories)
+        self.groups = np.asarray([element_group(category) for category in self.categories],
+                                 dtype=np.uint8)[category_codes]
+        self.bounding_boxes = coordinate_array(bounding_boxes).reshape(len(self.ids), 4, 2)
+        self.text_offsets = np.asarray(text_offsets, dtype=np.int64)
+        self.text_buffer = text_buffer
+        self.page_ranges = self.create_page_ranges()
+
+    @classmethod
+    def from_elements(cls, elements):
+        elements = sorted(elements, key=lambda element: element["page"])
+        categories = sorted({element["category"] for element in elements})
+        category_index = {category: code for code, category in enumerate(categories)}
+
+        texts = [element.get("text") or "" for element in elements]
+        text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in texts], out=text_offsets[1:])
+
+        bounding_boxes = np.asarray(
+            [[(coord["x"], coord["y"]) for coord in element["bounding_box"]]
+             for element in elements],
+            dtype=np.float64,
+        ).reshape(len(elements), 4, 2)
+
+        return cls(
+            ids=np.asarray([element["id"] for element in elements], dtype=np.int64),
+            pages=np.asarray([element["page"] for element in elements], dtype=np.int32),
+            category_codes=np.asarray([category_index[element["category"]] for element in elements],
+                                      dtype=np.uint8),
+            categories=categories,
+            bounding_boxes=bounding_boxes,
+            text_offsets=text_offsets,
+            text_buffer="".join(texts),
+        )
+
+    @classmethod
+    def from_page_elements(cls, page_elements):
+        return cls.from_elements(
+            element for page in page_elements.values() for element in page["elements"]
+        )
+
+    def create_page_ranges(self) -> dict[int, tuple[int, int]]:
+        page_numbers, starts = np.unique(self.pages, return_index=True)
+        ends = [*starts[1:], len(self.pages)]
+        return {int(page_num): (int(start), int(end))
+                for page_num, start, end in zip(page_numbers, starts, ends)}
+
+    def without_ids(self, element_ids):
+        keep = ~np.isin(self.ids, np.fromiter(element_ids, dtype=np.int64))
+        texts = [self.text_buffer[start:end] for start, end, kept
+                 in zip(self.text_offsets[:-1], self.text_offsets[1:], keep) if kept]
+        text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in texts], out=text_offsets[1:])
+
+        return ElementStore(
+            ids=self.ids[keep],
+            pages=self.pages[keep],
+            category_codes=self.category_codes[keep],
+            categories=self.categories,
+            bounding_boxes=self.bounding_boxes[keep],
+            text_offsets=text_offsets,
+            text_buffer="".join(texts),
+        )
+
+    def nbytes(self) -> int:
+        arrays = (self.ids, self.pages, self.category_codes, self.groups,
+                  self.bounding_boxes, self.text_offsets)
+        return sum(array.nbytes for array in arrays) + len(self.text_buffer.encode("utf-8"))
+
+    def __getitem__(self, page_num):
+        start, end = self.page_ranges[page_num]
+        return PageView(self, start, end)
+
+    def __iter__(self):
+        return iter(self.page_ranges)
+
+    def __len__(self):
+        return len(self.page_ranges)
+
+    # Constructor kwargs as plain lists; LangGraph's JsonPlusSerializer (MemorySaver's default)
+    # serializes objects exposing _asdict and rebuilds them with ElementStore(**kwargs).
+    def _asdict(self) -> dict:
+        return {
+            "ids": self.ids.tolist(),
+            "pages": self.pages.tolist(),
+            "category_codes": self.category_codes.tolist(),
+            "categories": list(self.categories),
+            "bounding_boxes": self.bounding_boxes.tolist(),
+            "text_offsets": self.text_offsets.tolist(),
+            "text_buffer": self.text_buffer,
+        }
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__
+                if name not in ("groups", "page_ranges")}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
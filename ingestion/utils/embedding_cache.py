@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from ingestion.utils.llm_scheduler import estimate_text_tokens
+
+# OpenAI accepts up to 2048 inputs and 300k tokens per embedding request.
+MAX_BATCH_SIZE = 256
+MAX_BATCH_TOKENS = 100000
+MAX_CONCURRENCY = 4
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def embedding_cache_key(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def embedding_model_id(embedding) -> str:
+    model = getattr(embedding, "model", None) or embedding.__class__.__name__
+    dimensions = getattr(embedding, "dimensions", None)
+    return f"{model}-{dimensions}d" if dimensions else model
+
+
+def model_slug(model: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, model: str):
+        self.model = model
+        self.cache_path = Path(cache_dir) / model_slug(model)
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.cache_path / "vectors.f32"
+        self.keys_path = self.cache_path / "keys.txt"
+        self.meta_path = self.cache_path / "meta.json"
+        self.lock = threading.Lock()
+        self.dimension = None
+        self.rows = dict()
+        self.vectors = None
+        self.load()
+
+    def load(self):
+        if not self.meta_path.exists() or not self.keys_path.exists():
+            return
+
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            self.dimension = json.load(f)["dimension"]
+        with open(self.keys_path, "r", encoding="utf-8") as f:
+            keys = f.read().split("\n")[:-1]
+
+        # Keys are appended after their vectors, so a torn write leaves extra vector rows or a
+        # partial key line. Both are cut off so the next append lines up keys and rows again.
+        row_bytes = 4 * self.dimension
+        num_rows = min(len(keys), self.vectors_path.stat().st_size // row_bytes)
+        keys = keys[:num_rows]
+        if self.vectors_path.stat().st_size != num_rows * row_bytes:
+            os.truncate(self.vectors_path, num_rows * row_bytes)
+        if self.keys_path.stat().st_size != sum(len(key) + 1 for key in keys):
+            self.keys_path.write_text("".join(f"{key}\n" for key in keys), encoding="utf-8")
+
+        self.rows = {key: row for row, key in enumerate(keys)}
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                 shape=(num_rows, self.dimension)) if num_rows else None
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        with self.lock:
+            rows = {key: self.rows[key] for key in keys if key in self.rows}
+            if not rows:
+                return dict()
+            matrix = np.asarray(self.vectors[list(rows.values())])
+        return dict(zip(rows, matrix))
+
+    def put_many(self, keys: list[str], vectors) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self.rows]
+            if not new:
+                return
+
+            if self.dimension is not None and vectors.shape[1] != self.dimension:
+                raise ValueError(f"Embedding cache for {self.model} holds {self.dimension}-d vectors, "
+                                 f"got {vectors.shape[1]}-d")
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                self.vectors_path.write_bytes(b"")
+                self.keys_path.write_text("", encoding="utf-8")
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model, "dimension": self.dimension}, f)
+
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.stack([vector for _, vector in new]).tobytes())
+            with open(self.keys_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{key}\n" for key, _ in new))
+
+            start = len(self.rows)
+            for offset, (key, _) in enumerate(new):
+                self.rows[key] = start + offset
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                     shape=(len(self.rows), self.dimension))
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embedding: Embeddings, cache_dir, max_batch_size=MAX_BATCH_SIZE,
+                 max_batch_tokens=MAX_BATCH_TOKENS, max_concurrency=MAX_CONCURRENCY):
+        self.embedding = embedding
+        self.model = getattr(embedding, "model", None) or embedding.__class__.__name__
+        self.cache = EmbeddingCache(cache_dir, embedding_model_id(embedding))
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.embedded_texts = 0
+        self.embedded_tokens = 0
+        self.embedding_seconds = 0.0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "model": self.model,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "embedded_texts": self.embedded_texts,
+            "embedded_tokens": self.embedded_tokens,
+            "embedding_seconds": round(self.embedding_seconds, 3),
+            "texts_per_second": round(self.embedded_texts / self.embedding_seconds, 1)
+            if self.embedding_seconds else 0.0,
+            "cache_entries": len(self.cache),
+        }
+
+    def create_batches(self, texts: list[str]) -> list[list[int]]:
+        batches, batch, batch_tokens = [], [], 0
+        for position, text in enumerate(texts):
+            tokens = estimate_text_tokens(text)
+            if batch and (len(batch) >= self.max_batch_size
+                          or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(position)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def lookup(self, texts: list[str]):
+        keys = [embedding_cache_key(text, self.cache.model) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        missed = dict()
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missed.setdefault(key, text)
+
+        num_missed = sum(1 for key in keys if key not in cached)
+        self.hits += len(texts) - num_missed
+        self.misses += num_missed
+        return keys, cached, list(missed), list(missed.values())
+
+    def store(self, keys, cached, missed_keys, missed_texts, batches, results) -> list[list[float]]:
+        for batch, vectors in zip(batches, results):
+            batch_keys = [missed_keys[position] for position in batch]
+            self.cache.put_many(batch_keys, vectors)
+            cached.update(zip(batch_keys, np.asarray(vectors, dtype=np.float32)))
+
+        self.embedded_texts += len(missed_texts)
+        self.embedded_tokens += sum(estimate_text_tokens(text) for text in missed_texts)
+        return [cached[key].tolist() for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, cached, missed_keys, missed_texts = self.lookup(texts)
+        batches = self.create_batches(missed_texts)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            results = list(executor.map(
+                lambda batch: self.embedding.embed_documents([missed_texts[i] for i in batch]),
+                batches,
+            ))
+        if batches:
+            self.embedding_seconds += time.perf_counter() - start
+
+        return self.store(keys, cached, missed_keys, missed_texts, batches, results)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, cached, missed_keys, missed_texts = self.lookup(texts)
+        batches = self.create_batches(missed_texts)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed(batch):
+            async with semaphore:
+                return await self.embedding.aembed_documents([missed_texts[i] for i in batch])
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(embed(batch) for batch in batches))
+        if batches:
+            self.embedding_seconds += time.perf_counter() - start
+
+        return self.store(keys, cached, missed_keys, missed_texts, batches, results)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embedding.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embedding.aembed_query(text)
@@ -0,0 +1,65 @@
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+MAX_HAMMING_DISTANCE = 6
+MAX_ASPECT_RATIO_DIFF = 0.2
+MAX_COLOR_DIFF = 16
+
+
+def dhash(image: Image.Image, hash_size: int = HASH_SIZE) -> np.ndarray:
+    gray = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def image_signature(file_path, hash_size: int = HASH_SIZE) -> tuple[np.ndarray, float, np.ndarray]:
+    with Image.open(file_path) as image:
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image)
+        width, height = image.size
+        thumbnail = image.convert("RGB").resize((16, 16))
+        mean_color = np.asarray(thumbnail, dtype=np.float32).mean(axis=(0, 1))
+        return dhash(image, hash_size), width / max(height, 1), mean_color
+
+
+def hamming_distances(hashes: np.ndarray, target: np.ndarray) -> np.ndarray:
+    return np.unpackbits(np.bitwise_xor(hashes, target), axis=-1).sum(axis=-1)
+
+
+def group_similar_images(image_paths: dict[int, str],
+                         max_distance: int = MAX_HAMMING_DISTANCE,
+                         max_aspect_ratio_diff: float = MAX_ASPECT_RATIO_DIFF,
+                         max_color_diff: float = MAX_COLOR_DIFF,
+                         hash_size: int = HASH_SIZE) -> dict[int, list[int]]:
+    image_groups = dict()
+    representative_ids = []
+    representative_hashes = []
+    representative_ratios = []
+    representative_colors = []
+
+    for image_id in sorted(image_paths):
+        image_hash, aspect_ratio, mean_color = image_signature(image_paths[image_id], hash_size)
+
+        if representative_ids:
+            distances = hamming_distances(np.stack(representative_hashes), image_hash)
+            ratios = np.asarray(representative_ratios)
+            ratio_diffs = np.abs(np.log(ratios / aspect_ratio))
+            color_diffs = np.abs(np.stack(representative_colors) - mean_color).max(axis=1)
+            candidates = np.flatnonzero((distances <= max_distance)
+                                        & (ratio_diffs <= max_aspect_ratio_diff)
+                                        & (color_diffs <= max_color_diff))
+            if candidates.size:
+                best = candidates[np.argmin(distances[candidates])]
+                image_groups[representative_ids[best]].append(image_id)
+                continue
+
+        image_groups[image_id] = [image_id]
+        representative_ids.append(image_id)
+        representative_hashes.append(image_hash)
+        representative_ratios.append(aspect_ratio)
+        representative_colors.append(mean_color)
+
+    return image_groups
@@ -0,0 +1,234 @@
+import io
+import os
+import time
+import base64
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from PIL import Image
+
+from ingestion.utils.llm_scheduler import estimate_image_tokens
+
+# Images are resized server-side to fit 2048px and then 768px on the short side,
+# so anything larger costs upload bytes without changing what the model sees.
+MAX_EDGE = 2048
+MAX_SHORT_EDGE = 768
+MAX_PALETTE_COLORS = 256
+JPEG_QUALITY = 85
+SUPPORTED_FORMATS = ("PNG", "JPEG", "WEBP", "GIF")
+
+_image_preparer = None
+_image_preparer_lock = threading.Lock()
+
+
+def set_image_preparer(image_preparer):
+    global _image_preparer
+    _image_preparer = image_preparer
+
+
+def get_image_preparer():
+    global _image_preparer
+    with _image_preparer_lock:
+        if _image_preparer is None:
+            _image_preparer = ImagePreparer()
+        return _image_preparer
+
+
+class ImagePreparer:
+    def __init__(self, max_edge=MAX_EDGE, max_short_edge=MAX_SHORT_EDGE, token_budget=None,
+                 model_name="gpt-4o-mini", jpeg_quality=JPEG_QUALITY, use_webp=False,
+                 cache_dir=None, max_memory_entries=512,
+                 max_entries: int = 50000,
+                 max_bytes: int = 1024 * 1024 * 1024,
+                 max_age_seconds: float = 30 * 24 * 60 * 60):
+        self.max_edge = max_edge
+        self.max_short_edge = max_short_edge
+        self.token_budget = token_budget
+        self.model_name = model_name
+        self.jpeg_quality = jpeg_quality
+        self.use_webp = use_webp
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_memory_entries = max_memory_entries
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+        self.memory_cache = OrderedDict()
+        self.file_stats = dict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def settings(self) -> str:
+        return (f"{self.max_edge}:{self.max_short_edge}:{self.token_budget}:{self.model_name}:"
+                f"{self.jpeg_quality}:{self.use_webp}")
+
+    def cache_key(self, image_bytes: bytes, lossless: bool = False) -> str:
+        digest = hashlib.sha256(f"{self.settings()}:{lossless}".encode())
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def target_size(self, width: int, height: int) -> tuple[int, int]:
+        scale = min(1.0, self.max_edge / max(width, height),
+                    self.max_short_edge / min(width, height))
+
+        if self.token_budget is not None:
+            while (scale > 0.1 and estimate_image_tokens(
+                    round(width * scale), round(height * scale), self.model_name
+            ) > self.token_budget):
+                scale *= 0.9
+
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def choose_format(self, image: Image.Image, lossless: bool = False) -> str:
+        if lossless:
+            return "PNG"
+        if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+            return "WEBP" if self.use_webp else "PNG"
+
+        thumbnail = image.convert("RGB")
+        thumbnail.thumbnail((256, 256))
+        if thumbnail.getcolors(MAX_PALETTE_COLORS) is not None:
+            return "PNG"
+        return "WEBP" if self.use_webp else "JPEG"
+
+    # lossless keeps PNG regardless of colour count, for images whose text must stay legible.
+    def encode(self, image_bytes: bytes, lossless: bool = False) -> str:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            original_format = image.format
+            original_size = image.size
+            image.load()
+
+            size = self.target_size(*image.size)
+            if size != image.size:
+                image = image.resize(size, Image.LANCZOS)
+            image_format = self.choose_format(image, lossless)
+
+            if image_format == "JPEG":
+                image = image.convert("RGB")
+            elif image_format == "PNG" and image.mode not in ("RGBA", "LA", "P"):
+                colors = image.convert("RGB").getcolors(MAX_PALETTE_COLORS)
+                if colors is not None:
+                    image = image.convert("RGB").quantize(colors=len(colors))
+
+            buffer = io.BytesIO()
+            if image_format == "PNG":
+                image.save(buffer, format=image_format, optimize=True)
+            else:
+                image.save(buffer, format=image_format, quality=self.jpeg_quality)
+            encoded = buffer.getvalue()
+
+        if (size == original_size and original_format in SUPPORTED_FORMATS
+                and len(image_bytes) <= len(encoded)):
+            encoded, image_format = image_bytes, original_format
+
+        mime_type = f"image/{image_format.lower()}"
+        return f"data:{mime_type};base64,{base64.b64encode(encoded).decode('utf-8')}"
+
+    def load_from_disk(self, key: str):
+        if self.cache_dir is None:
+            return None
+        try:
+            return (self.cache_dir / key[:2] / f"{key}.txt").read_text()
+        except FileNotFoundError:
+            return None
+
+    def save_to_disk(self, key: str, data_url: str) -> None:
+        if self.cache_dir is None:
+            return
+        entry_path = self.cache_dir / key[:2] / f"{key}.txt"
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(data_url)
+        os.replace(tmp_path, entry_path)
+
+    def evict(self) -> int:
+        if self.cache_dir is None:
+            return 0
+
+        now = time.time()
+        entries = []
+        num_evicted = 0
+
+        for entry_path in self.cache_dir.glob("*/*.txt"):
+            stat = entry_path.stat()
+            if now - stat.st_mtime > self.max_age_seconds:
+                entry_path.unlink(missing_ok=True)
+                num_evicted += 1
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, entry_path = entries.pop(0)
+            entry_path.unlink(missing_ok=True)
+            total_bytes -= size
+            num_evicted += 1
+
+        return num_evicted
+
+    def remember(self, key: str, data_url: str) -> None:
+        with self.lock:
+            self.memory_cache[key] = data_url
+            self.memory_cache.move_to_end(key)
+            while len(self.memory_cache) > self.max_memory_entries:
+                self.memory_cache.popitem(last=False)
+
+    def prepare(self, file_path, lossless: bool = False) -> str:
+        with open(file_path, "rb") as f:
+            image_bytes = f.read()
+        key = self.cache_key(image_bytes, lossless)
+
+        with self.lock:
+            data_url = self.memory_cache.get(key)
+            if data_url is not None:
+                self.memory_cache.move_to_end(key)
+                self.memory_hits += 1
+
+        if data_url is None:
+            data_url = self.load_from_disk(key)
+            if data_url is not None:
+                with self.lock:
+                    self.disk_hits += 1
+            else:
+                data_url = self.encode(image_bytes, lossless)
+                self.save_to_disk(key, data_url)
+                with self.lock:
+                    self.misses += 1
+            self.remember(key, data_url)
+
+        with self.lock:
+            self.file_stats[str(file_path)] = {
+                "original_bytes": len(image_bytes),
+                "encoded_bytes": len(base64.b64decode(data_url.split(",", 1)[1])),
+                "payload_bytes": len(data_url),
+            }
+        return data_url
+
+    def payload_stats(self, file_paths=None) -> dict:
+        with self.lock:
+            if file_paths is None:
+                file_stats = list(self.file_stats.values())
+            else:
+                file_stats = [self.file_stats[str(file_path)] for file_path in file_paths
+                              if str(file_path) in self.file_stats]
+
+            original_bytes = sum(stats["original_bytes"] for stats in file_stats)
+            encoded_bytes = sum(stats["encoded_bytes"] for stats in file_stats)
+            return {
+                "num_images": len(file_stats),
+                "original_bytes": original_bytes,
+                "encoded_bytes": encoded_bytes,
+                "saved_bytes": original_bytes - encoded_bytes,
+                "payload_bytes": sum(stats["payload_bytes"] for stats in file_stats),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
@@ -4,13 +4,20 @@ import time
 import random
 import asyncio
 import aiohttp
-import nest_asyncio
 from pathlib import Path
 from aiohttp import FormData
 from ingestion import logger
+from ingestion.utils.rate_limiter import AsyncTokenBucket
+from ingestion.utils.pdf_source import read_split_bytes
 
 UPSTAGE_INFERENCE_URL = "https://ocr-demo.upstage.ai/api/layout-analysis/inference"
 UPSTAGE_RESULT_BASE_URL = "https://ocr-demo.upstage.ai/api/result/"
+UPSTAGE_ANALYZER_VERSION = "receipt-extraction-3.2.0"
+
+RESULT_READY = "ready"
+RESULT_PENDING = "pending"
+RESULT_FAILED = "failed"
+RESULT_EXPIRED = "expired"
 
 upstage_api_headers = {"Accept": "*/*",
                        "origin": "https://d3tgkvf102zvh7.cloudfront.net",
@@ -21,144 +28,223 @@ upstage_api_headers = {"Accept": "*/*",
 
 
 class LayoutAnalyzeRequester:
-    def __init__(self, token, state):
+    def __init__(self, token, state,
+                 max_concurrency=4,
+                 requests_per_second=2.0,
+                 max_retries=6,
+                 base_delay=1.0,
+                 max_delay=32.0,
+                 initial_poll_interval=2.0,
+                 min_poll_interval=0.5,
+                 max_poll_interval=30.0,
+                 poll_backoff=1.5,
+                 poll_timeout=600.0):
         self.token = token
         self.file_paths = state["file_paths"]
         self.splitted_file_paths = state["splitted_file_paths"]
+        self.splitted_file_buffers = state.get("splitted_file_buffers", dict())
         self.analyzed_json_paths = self.file_paths["analyzed_jsons"]
         self.analysis_request_info_path = self.file_paths["analyze_request_info"]
 
-    async def _send_document_analysis_requests(self, target_file_paths):
-        analysis_request_info = json.load(open(self.analysis_request_info_path, "r"))
-        
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            tasks = [self._delayed_document_analysis_request(session, fp) 
-                     for fp in target_file_paths]
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-
-            for idx, result in enumerate(results):
-                if isinstance(result, Exception):
-                    logger.info(f"Request {idx + 1}: Failed with error {result}", level="error")
-                else:
-                    if result:
-                        file_path = result.get("file_path")
-                        request_id = result.get("request_id")
-                        logger.info(f"Request {idx + 1} File path[{file_path}]: Request ID = {request_id}")
-                        analysis_request_info[file_path]["request_id"] = request_id
-            try:
-                with open(self.analysis_request_info_path, "w") as f:
-                    json.dump(analysis_request_info, f, indent=4)
-            except IOError as e:
-                logger.info(f"Failed to save request IDs: {e}", level="error")
-
-    async def _delayed_document_analysis_request(self, session, file_path):
-        await asyncio.sleep(random.uniform(1, 3))
-        return await self._send_document_analysis_request(session, file_path)
-
-    async def _send_document_analysis_request(self, session, file_path):
-        request_id = None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.initial_poll_interval = initial_poll_interval
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff = poll_backoff
+        self.poll_timeout = poll_timeout
+        self.processing_time_ema = None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = AsyncTokenBucket(requests_per_second)
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(ssl=False, limit=self.max_concurrency)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.session.close()
+        self.session = None
+
+    def load_request_info(self):
+        with open(self.analysis_request_info_path, "r") as f:
+            return json.load(f)
+
+    def save_request_info(self, analysis_request_info):
+        try:
+            with open(self.analysis_request_info_path, "w") as f:
+                json.dump(analysis_request_info, f, indent=4)
+        except IOError as e:
+            logger.error(f"Failed to save analysis request info: {e}")
+
+    async def _with_backoff(self, request, *args):
+        for attempt in range(self.max_retries + 1):
+            async with self.semaphore:
+                await self.rate_limiter.acquire()
+                result = await request(*args)
+
+            if result is not None:
+                return result
+
+            if attempt < self.max_retries:
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                await asyncio.sleep(delay)
+
+        return None
+
+    async def _send_document_analysis_request(self, file_path):
         form = FormData()
         form.add_field("token", self.token)
         form.add_field("serviceName", "document-ai")
         form.add_field("type", "drsp")
-        form.add_field("url", "receipt-extraction-3.2.0")
-        form.add_field("document", open(file_path, 'rb'),
+        form.add_field("url", UPSTAGE_ANALYZER_VERSION)
+        form.add_field("document", read_split_bytes(file_path, self.splitted_file_buffers),
                        filename=file_path,
                        content_type='application/pdf')
 
         try:
-            async with session.post(url=UPSTAGE_INFERENCE_URL, 
-                                   headers=upstage_api_headers,
-                                   data=form) as response:
-                
+            async with self.session.post(url=UPSTAGE_INFERENCE_URL,
+                                         headers=upstage_api_headers,
+                                         data=form) as response:
                 if response.status == 200:
                     json_response = await response.json()
-                    request_id = json_response.get('requestId')
+                    return json_response.get('requestId')
 
-                else:
-                    logger.error(f"[Inference Req Failed]: Status {response.status}")
+                logger.error(f"[Inference Req Failed]: Status {response.status}")
         except aiohttp.ClientError as e:
-            logger.error(f"[Inference Req Error]: {e}") 
-        
-        return {"file_path": file_path, "request_id": request_id}
+            logger.error(f"[Inference Req Error]: {e}")
 
-    async def _send_get_result_requests(self, target_request_info):
-        analysis_request_info = json.load(open(self.analysis_request_info_path, "r"))
-
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            tasks = [self._delayed_get_result_request(session, file_path, info["request_id"])
-                     for file_path, info in target_request_info.items()]
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            for idx, result in enumerate(results):
-                if isinstance(result, Exception):
-                    logger.error(f"Get Result Request {idx + 1}: Failed with error {result}")
-                else:
-                    file_path = result.get("file_path")
-                    result_file_path = result.get("result")
-                    analysis_request_info[file_path]["analyzed_json_file_path"] = result_file_path
-                    logger.info(f"Get Result Request {idx + 1}: File path {file_path}: Successfully saved result.")
-            try:
-                with open(self.analysis_request_info_path, "w") as f:
-                    json.dump(analysis_request_info, f, indent=4)
-            except IOError as e:
-                logger.error(f"Failed to save analysis result: {e}")
-
-    async def _delayed_get_result_request(self, session, file_path, request_id):
-        await asyncio.sleep(random.uniform(1, 3))
-        return await self._send_get_result_request(session, file_path, request_id)
-
-    async def _send_get_result_request(self, session, file_path, request_id):
+        return None
+
+    async def _send_get_result_request(self, file_path, request_id):
         result_file_path = os.path.join(self.analyzed_json_paths, Path(file_path).stem + ".json")
         try:
-            async with session.get(url=f"{UPSTAGE_RESULT_BASE_URL}/{request_id}",
-                                   headers=upstage_api_headers) as response:
+            async with self.session.get(url=f"{UPSTAGE_RESULT_BASE_URL}/{request_id}",
+                                        headers=upstage_api_headers) as response:
                 if response.status == 200:
+                    json_response = await response.json()
+                    if "elements" not in json_response or "metadata" not in json_response:
+                        return RESULT_PENDING, None
+
                     with open(result_file_path, "w") as f:
-                        json.dump(await response.json(), f, ensure_ascii=False, indent=4)
-                        return {"file_path": file_path, "result": result_file_path}
-                else:
-                    logger.error(f"[Get Result Req Failed]: Status {response.status}")
+                        json.dump(json_response, f, ensure_ascii=False, indent=4)
+                    return RESULT_READY, result_file_path
+
+                if response.status == 202:
+                    return RESULT_PENDING, None
+                if response.status == 404:
+                    return RESULT_EXPIRED, None
+
+                logger.error(f"[Get Result Req Failed]: Status {response.status}")
         except aiohttp.ClientError as e:
             logger.error(f"[Get Result Req Error]: {e}")
 
-        return {"file_path": file_path, "result": None}
-        
-    def execute_analysis_requests(self):
-        nest_asyncio.apply()
-        sleep_time = 1
-        
-        while True:
-            analysis_request_info = json.load(open(self.analysis_request_info_path, "r"))
-            target_file_paths = [file_path 
-                                 for file_path, request_info in analysis_request_info.items()
-                                 if not request_info["request_id"]]
-            
-            if (not target_file_paths) or (sleep_time > 64):
-                break
+        return RESULT_FAILED, None
 
-            asyncio.run(self._send_document_analysis_requests(target_file_paths))
-            sleep_time *= 2
-            time.sleep(sleep_time)
+    def next_poll_interval(self, previous_interval=None):
+        if previous_interval is not None:
+            return min(self.max_poll_interval, previous_interval * self.poll_backoff)
+        if self.processing_time_ema is None:
+            return self.initial_poll_interval
+        return min(self.max_poll_interval,
+                   max(self.min_poll_interval, self.processing_time_ema * 0.8))
 
-        return analysis_request_info
-    
-    def excute_analysis_result_requests(self):
-        nest_asyncio.apply()
-        sleep_time = 1
+    def observe_processing_time(self, seconds):
+        if self.processing_time_ema is None:
+            self.processing_time_ema = seconds
+        else:
+            self.processing_time_ema = 0.7 * self.processing_time_ema + 0.3 * seconds
 
-        while True:
-            analysis_request_info = json.load(open(self.analysis_request_info_path, "r"))
-            target_request_info = {file_path: request_info 
-                             for file_path, request_info in analysis_request_info.items() 
-                            if not request_info["analyzed_json_file_path"]}
+    async def request_analysis(self, file_path):
+        request_id = await self._with_backoff(self._send_document_analysis_request, file_path)
+        return {"file_path": file_path, "request_id": request_id}
+
+    async def poll_result(self, file_path, request_id):
+        submitted_at = time.monotonic()
+        interval = self.next_poll_interval()
+        num_polls = 0
+        num_failures = 0
+
+        while time.monotonic() - submitted_at < self.poll_timeout:
+            await asyncio.sleep(interval)
+            async with self.semaphore:
+                await self.rate_limiter.acquire()
+                status, result_file_path = await self._send_get_result_request(file_path, request_id)
+            num_polls += 1
+
+            if status == RESULT_READY:
+                self.observe_processing_time(time.monotonic() - submitted_at)
+                return {"result": result_file_path, "num_polls": num_polls}
+
+            if status == RESULT_EXPIRED:
+                return {"result": None, "num_polls": num_polls, "expired": True}
+
+            if status == RESULT_FAILED:
+                num_failures += 1
+                if num_failures > self.max_retries:
+                    break
+                interval = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** num_failures))
+            else:
+                interval = self.next_poll_interval(interval)
+
+        return {"result": None, "num_polls": num_polls}
+
+    async def analyze_file(self, file_path, request_id=None, on_submitted=None):
+        started_at = time.monotonic()
+        num_polls = 0
+        num_submits = 0
 
-            if (not target_request_info) or (sleep_time > 64):
+        while True:
+            if not request_id:
+                request_id = (await self.request_analysis(file_path))["request_id"]
+                num_submits += 1
+                # Persist the id before polling so a crash mid-poll resumes instead of resubmitting.
+                if request_id and on_submitted is not None:
+                    on_submitted(request_id)
+            if not request_id:
+                return {"file_path": file_path, "request_id": None, "result": None,
+                        "num_polls": num_polls, "seconds": round(time.monotonic() - started_at, 3)}
+
+            polled = await self.poll_result(file_path, request_id)
+            num_polls += polled["num_polls"]
+            if not polled.get("expired"):
                 break
 
-            asyncio.run(self._send_get_result_requests(target_request_info))
-            sleep_time *= 2
-            time.sleep(sleep_time)
+            logger.warning(f"File path[{file_path}]: Request {request_id} not found, resubmitting")
+            request_id = None
+            if num_submits > self.max_retries:
+                break
 
-        return analysis_request_info
\ No newline at end of file
+        return {"file_path": file_path, "request_id": request_id, "result": polled["result"],
+                "num_polls": num_polls, "seconds": round(time.monotonic() - started_at, 3)}
+
+    async def iter_analysis_jobs(self):
+        analysis_request_info = self.load_request_info()
+
+        def save_request_id(file_path):
+            def save(request_id):
+                analysis_request_info[file_path]["request_id"] = request_id
+                self.save_request_info(analysis_request_info)
+            return save
+
+        tasks = [self.analyze_file(file_path, request_info["request_id"],
+                                   on_submitted=save_request_id(file_path))
+                 for file_path, request_info in analysis_request_info.items()
+                 if not request_info["analyzed_json_file_path"]]
+
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            file_path = result["file_path"]
+            analysis_request_info[file_path]["request_id"] = result["request_id"]
+            analysis_request_info[file_path]["analyzed_json_file_path"] = result["result"]
+            self.save_request_info(analysis_request_info)
+
+            if result["result"]:
+                logger.info(f"File path[{file_path}]: Result ready after {result['seconds']}s")
+            else:
+                logger.error(f"File path[{file_path}]: Layout analysis failed")
+            yield result
@@ -0,0 +1,96 @@
+import os
+import json
+import hashlib
+import pymupdf
+from pathlib import Path
+
+from ingestion.utils.pdf_source import open_pdf
+
+
+def page_content_hash(doc: pymupdf.Document, page: pymupdf.Page) -> str:
+    digest = hashlib.sha256()
+    digest.update(repr((tuple(page.rect), page.rotation)).encode())
+    digest.update(page.read_contents())
+
+    for image in page.get_images(full=True):
+        digest.update(doc.xref_stream_raw(image[0]) or b"")
+
+    for xobject in page.get_xobjects():
+        digest.update(doc.xref_stream_raw(xobject[0]) or b"")
+
+    for font in page.get_fonts(full=True):
+        basefont = font[3]
+        digest.update(basefont.encode())
+        if font[1] not in ("n/a", ""):
+            digest.update(doc.extract_font(font[0])[-1] or b"")
+
+    return digest.hexdigest()
+
+
+def pdf_content_hash(pdf_file, analyzer_version: str) -> str:
+    digest = hashlib.sha256(analyzer_version.encode())
+    with open_pdf(pdf_file) as doc:
+        for page in doc:
+            digest.update(page_content_hash(doc, page).encode())
+    return digest.hexdigest()
+
+
+class LayoutCache:
+    def __init__(self, cache_dir, analyzer_version: str,
+                 max_entries: int = 20000,
+                 max_bytes: int = 1024 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.analyzer_version = analyzer_version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, pdf_file) -> str:
+        return pdf_content_hash(pdf_file, self.analyzer_version)
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str):
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                json_data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        os.utime(entry_path)
+        self.hits += 1
+        return json_data
+
+    def put(self, key: str, json_data: dict) -> None:
+        entry_path = self.entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = entry_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(json_data, f, ensure_ascii=False)
+        os.replace(tmp_path, entry_path)
+
+    def evict(self) -> int:
+        entries = []
+        for entry_path in self.cache_dir.glob("*/*.json"):
+            stat = entry_path.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        num_evicted = 0
+
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, entry_path = entries.pop(0)
+            entry_path.unlink(missing_ok=True)
+            total_bytes -= size
+            num_evicted += 1
+
+        return num_evicted
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
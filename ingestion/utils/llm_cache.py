@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from collections import defaultdict
+from langchain_core.runnables import Runnable
+from langchain_core.messages import AIMessage, convert_to_messages
+from langchain_core.prompt_values import PromptValue
+
+_llm_response_cache = None
+
+
+def set_llm_response_cache(cache):
+    global _llm_response_cache
+    _llm_response_cache = cache
+
+
+def get_llm_response_cache():
+    return _llm_response_cache
+
+
+def llm_cache_stats(namespace: str = None) -> dict:
+    if _llm_response_cache is None:
+        return dict()
+    return _llm_response_cache.stats(namespace)
+
+
+def to_messages(input):
+    if isinstance(input, PromptValue):
+        return input.to_messages()
+    if isinstance(input, str):
+        return convert_to_messages([("human", input)])
+    return convert_to_messages(input)
+
+
+def cache_option(value):
+    if hasattr(value, "model_json_schema"):
+        return value.model_json_schema()
+    return repr(value)
+
+
+def llm_cache_key(messages, model_name: str, temperature, **options) -> str:
+    payload = {
+        "model": model_name,
+        "temperature": temperature,
+        "messages": [{"type": message.type, "content": message.content}
+                     for message in messages],
+    }
+    if options:
+        payload["options"] = json.loads(json.dumps(options, default=cache_option))
+    return hashlib.sha256(
+        json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()
+    ).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, cache_dir,
+                 max_entries: int = 100000,
+                 max_bytes: int = 1024 * 1024 * 1024,
+                 max_age_seconds: float = 30 * 24 * 60 * 60):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def count(self, counter, namespace):
+        with self.lock:
+            counter[namespace] += 1
+
+    def get(self, key: str, namespace: str = "default"):
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.count(self.misses, namespace)
+            return None
+
+        if time.time() - entry["created_at"] > self.max_age_seconds:
+            entry_path.unlink(missing_ok=True)
+            self.count(self.misses, namespace)
+            return None
+
+        os.utime(entry_path)
+        self.count(self.hits, namespace)
+        return entry["content"]
+
+    def put(self, key: str, content, namespace: str = "default") -> None:
+        entry_path = self.entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"namespace": namespace, "created_at": time.time(), "content": content},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, entry_path)
+
+    def evict(self) -> int:
+        now = time.time()
+        entries = []
+        num_evicted = 0
+
+        for entry_path in self.cache_dir.glob("*/*.json"):
+            stat = entry_path.stat()
+            if now - stat.st_mtime > self.max_age_seconds:
+                entry_path.unlink(missing_ok=True)
+                num_evicted += 1
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, entry_path = entries.pop(0)
+            entry_path.unlink(missing_ok=True)
+            total_bytes -= size
+            num_evicted += 1
+
+        return num_evicted
+
+    def stats(self, namespace: str = None) -> dict:
+        with self.lock:
+            if namespace is not None:
+                return {"hits": self.hits[namespace], "misses": self.misses[namespace]}
+            return {namespace: {"hits": self.hits[namespace], "misses": self.misses[namespace]}
+                    for namespace in sorted(set(self.hits) | set(self.misses))}
+
+
+class CachedChatModel(Runnable):
+    def __init__(self, llm, namespace: str, cache: LLMResponseCache = None):
+        self.llm = llm
+        self.namespace = namespace
+        self._cache = cache
+
+    @property
+    def cache(self):
+        return self._cache or get_llm_response_cache()
+
+    def cache_key(self, input, **kwargs) -> str:
+        return llm_cache_key(to_messages(input),
+                             getattr(self.llm, "model_name", None),
+                             getattr(self.llm, "temperature", None),
+                             **kwargs)
+
+    def invoke(self, input, config=None, **kwargs):
+        cache = self.cache
+        if cache is None:
+            return self.llm.invoke(input, config, **kwargs)
+
+        key = self.cache_key(input, **kwargs)
+        content = cache.get(key, self.namespace)
+        if content is not None:
+            return AIMessage(content=content)
+
+        response = self.llm.invoke(input, config, **kwargs)
+        cache.put(key, response.content, self.namespace)
+        return response
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        cache = self.cache
+        if cache is None:
+            return await self.llm.ainvoke(input, config, **kwargs)
+
+        key = self.cache_key(input, **kwargs)
+        content = cache.get(key, self.namespace)
+        if content is not None:
+            return AIMessage(content=content)
+
+        response = await self.llm.ainvoke(input, config, **kwargs)
+        cache.put(key, response.content, self.namespace)
+        return response
+
+    def lookup(self, cache, inputs, **kwargs):
+        keys = [self.cache_key(input, **kwargs) for input in inputs]
+        responses = [cache.get(key, self.namespace) for key in keys]
+        responses = [None if content is None else AIMessage(content=content)
+                     for content in responses]
+        missed = [idx for idx, response in enumerate(responses) if response is None]
+        return keys, responses, missed
+
+    def missed_configs(self, config, missed):
+        if isinstance(config, list):
+            return [config[idx] for idx in missed]
+        return config
+
+    def store(self, cache, keys, responses, missed, generated):
+        for idx, response in zip(missed, generated):
+            responses[idx] = response
+            if isinstance(response, AIMessage):
+                cache.put(keys[idx], response.content, self.namespace)
+        return responses
+
+    def batch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        cache = self.cache
+        if cache is None or not inputs:
+            return self.llm.batch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+
+        keys, responses, missed = self.lookup(cache, inputs, **kwargs)
+        if not missed:
+            return responses
+
+        generated = self.llm.batch([inputs[idx] for idx in missed],
+                                   self.missed_configs(config, missed),
+                                   return_exceptions=return_exceptions, **kwargs)
+        return self.store(cache, keys, responses, missed, generated)
+
+    async def abatch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        cache = self.cache
+        if cache is None or not inputs:
+            return await self.llm.abatch(inputs, config, return_exceptions=return_exceptions,
+                                         **kwargs)
+
+        keys, responses, missed = self.lookup(cache, inputs, **kwargs)
+        if not missed:
+            return responses
+
+        generated = await self.llm.abatch([inputs[idx] for idx in missed],
+                                          self.missed_configs(config, missed),
+                                          return_exceptions=return_exceptions, **kwargs)
+        return self.store(cache, keys, responses, missed, generated)
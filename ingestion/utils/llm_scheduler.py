@@ -0,0 +1,343 @@
+import io
+import math
+import time
+import random
+import heapq
+import base64
+import asyncio
+import itertools
+import threading
+from functools import lru_cache
+from collections import defaultdict
+from PIL import Image
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from langchain_core.runnables import Runnable
+
+from ingestion import logger
+from ingestion.utils.llm_cache import to_messages
+
+PRIORITY_PAGE_SUMMARY = 0
+PRIORITY_ELEMENT_SUMMARY = 1
+PRIORITY_DEFAULT = 2
+
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 200000
+DEFAULT_OUTPUT_TOKENS = 512
+
+# Connection errors (including timeouts) and 5xx responses only back off the failing
+# call; they say nothing about the shared rate limit. Delays match the OpenAI client's.
+TRANSIENT_ERRORS = (APIConnectionError, InternalServerError)
+INITIAL_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 8.0
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# (base tokens, tokens per 512px tile)
+IMAGE_TOKEN_COSTS = {
+    "gpt-4o-mini": (2833, 5667),
+}
+DEFAULT_IMAGE_TOKEN_COST = (85, 170)
+
+_llm_scheduler = None
+_llm_scheduler_lock = threading.Lock()
+
+
+def set_llm_scheduler(scheduler):
+    global _llm_scheduler
+    _llm_scheduler = scheduler
+
+
+def get_llm_scheduler():
+    global _llm_scheduler
+    with _llm_scheduler_lock:
+        if _llm_scheduler is None:
+            _llm_scheduler = LLMScheduler()
+        return _llm_scheduler
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str):
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model_name)
+    except Exception as e:
+        logger.warning(f"Falling back to byte-length token estimates for {model_name}: {e}")
+        return None
+
+
+def estimate_text_tokens(text: str, model_name: str = "gpt-4o-mini") -> int:
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return math.ceil(len(text.encode("utf-8")) / 3)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def estimate_image_tokens(width: int, height: int, model_name: str = "gpt-4o-mini",
+                          detail: str = "auto") -> int:
+    base_tokens, tile_tokens = IMAGE_TOKEN_COSTS.get(model_name, DEFAULT_IMAGE_TOKEN_COST)
+    if detail == "low":
+        return base_tokens
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return base_tokens + tile_tokens * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def image_size_from_url(url: str):
+    if not url.startswith("data:"):
+        return None
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def estimate_message_tokens(messages, model_name: str = "gpt-4o-mini") -> int:
+    num_tokens = 0
+    for message in messages:
+        num_tokens += MESSAGE_OVERHEAD_TOKENS
+        content = message.content
+        if isinstance(content, str):
+            num_tokens += estimate_text_tokens(content, model_name)
+            continue
+
+        for part in content:
+            if isinstance(part, str):
+                num_tokens += estimate_text_tokens(part, model_name)
+            elif part.get("type") == "text":
+                num_tokens += estimate_text_tokens(part["text"], model_name)
+            elif part.get("type") == "image_url":
+                image_url = part["image_url"]
+                size = image_size_from_url(image_url["url"]) or (2048, 2048)
+                num_tokens += estimate_image_tokens(*size, model_name,
+                                                    image_url.get("detail", "auto"))
+    return num_tokens
+
+
+def set_wakeup(wakeup):
+    if not wakeup.done():
+        wakeup.set_result(None)
+
+
+class LLMScheduler:
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_budget = float(requests_per_minute)
+        self.token_budget = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+        self.condition = threading.Condition()
+        self.waiters = []
+        # ticket -> (loop, future) for coroutines parked in aacquire; woken with the condition.
+        self.async_waiters = dict()
+        self.sequence = itertools.count()
+        self.stats_by_priority = defaultdict(lambda: defaultdict(float))
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.request_budget = min(self.requests_per_minute,
+                                  self.request_budget + elapsed * self.requests_per_minute / 60)
+        self.token_budget = min(self.tokens_per_minute,
+                                self.token_budget + elapsed * self.tokens_per_minute / 60)
+
+    def wait_time(self, tokens) -> float:
+        return max(
+            0.0,
+            self.paused_until - time.monotonic(),
+            (1 - self.request_budget) * 60 / self.requests_per_minute,
+            (tokens - self.token_budget) * 60 / self.tokens_per_minute,
+        )
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_DEFAULT) -> int:
+        tokens = min(tokens, self.tokens_per_minute)
+        started_at = time.monotonic()
+
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiters, ticket)
+            try:
+                while True:
+                    self.refill()
+                    if self.waiters[0] != ticket:
+                        self.condition.wait()
+                        continue
+                    wait = self.wait_time(tokens)
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+
+                self.request_budget -= 1
+                self.token_budget -= tokens
+            finally:
+                self.waiters.remove(ticket)
+                heapq.heapify(self.waiters)
+                self.notify_waiters()
+
+            self.record_acquire(tokens, priority, started_at)
+        return tokens
+
+    async def aacquire(self, tokens: int, priority: int = PRIORITY_DEFAULT) -> int:
+        tokens = min(tokens, self.tokens_per_minute)
+        started_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiters, ticket)
+        try:
+            while True:
+                with self.condition:
+                    self.refill()
+                    wait = None
+                    if self.waiters[0] == ticket:
+                        wait = self.wait_time(tokens)
+                        if wait <= 0:
+                            self.request_budget -= 1
+                            self.token_budget -= tokens
+                            break
+                    wakeup = loop.create_future()
+                    self.async_waiters[ticket] = (loop, wakeup)
+                try:
+                    await asyncio.wait({wakeup}, timeout=wait)
+                finally:
+                    with self.condition:
+                        self.async_waiters.pop(ticket, None)
+        finally:
+            with self.condition:
+                self.waiters.remove(ticket)
+                heapq.heapify(self.waiters)
+                self.notify_waiters()
+
+        with self.condition:
+            self.record_acquire(tokens, priority, started_at)
+        return tokens
+
+    def record_acquire(self, tokens, priority, started_at):
+        stats = self.stats_by_priority[priority]
+        stats["requests"] += 1
+        stats["estimated_tokens"] += tokens
+        stats["wait_seconds"] += time.monotonic() - started_at
+
+    def notify_waiters(self):
+        self.condition.notify_all()
+        for loop, wakeup in self.async_waiters.values():
+            loop.call_soon_threadsafe(set_wakeup, wakeup)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int, priority: int = PRIORITY_DEFAULT):
+        with self.condition:
+            self.refill()
+            self.token_budget = min(self.tokens_per_minute,
+                                    self.token_budget + estimated_tokens - actual_tokens)
+            self.stats_by_priority[priority]["actual_tokens"] += actual_tokens
+            self.notify_waiters()
+
+    def pause(self, seconds: float, priority: int = PRIORITY_DEFAULT):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.stats_by_priority[priority]["rate_limited"] += 1
+            self.notify_waiters()
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {priority: {key: round(value, 3) for key, value in stats.items()}
+                    for priority, stats in sorted(self.stats_by_priority.items())}
+
+
+def retry_after_seconds(error: RateLimitError, default: float = 10.0) -> float:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after", default))
+    except (AttributeError, TypeError, ValueError):
+        return default
+
+
+def transient_retry_seconds(attempt: int) -> float:
+    delay = min(INITIAL_RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY)
+    return delay * (1 - 0.25 * random.random())
+
+
+class ScheduledChatModel(Runnable):
+    def __init__(self, llm, priority: int = PRIORITY_DEFAULT, scheduler: LLMScheduler = None,
+                 expected_output_tokens: int = DEFAULT_OUTPUT_TOKENS, max_retries: int = 6):
+        self.llm = llm
+        self.priority = priority
+        self._scheduler = scheduler
+        self.expected_output_tokens = expected_output_tokens
+        self.max_retries = max_retries
+
+    @property
+    def scheduler(self):
+        return self._scheduler or get_llm_scheduler()
+
+    @property
+    def model_name(self):
+        return getattr(self.llm, "model_name", None)
+
+    @property
+    def temperature(self):
+        return getattr(self.llm, "temperature", None)
+
+    def estimate_tokens(self, input) -> int:
+        return (estimate_message_tokens(to_messages(input), self.model_name)
+                + self.expected_output_tokens)
+
+    def actual_tokens(self, response, estimated_tokens) -> int:
+        usage_metadata = getattr(response, "usage_metadata", None) or {}
+        return usage_metadata.get("total_tokens", estimated_tokens)
+
+    def invoke(self, input, config=None, **kwargs):
+        scheduler = self.scheduler
+        estimated_tokens = self.estimate_tokens(input)
+
+        for attempt in range(self.max_retries + 1):
+            estimated_tokens = scheduler.acquire(estimated_tokens, self.priority)
+            try:
+                response = self.llm.invoke(input, config, **kwargs)
+            except RateLimitError as e:
+                scheduler.pause(retry_after_seconds(e), self.priority)
+                if attempt == self.max_retries:
+                    raise
+                continue
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = transient_retry_seconds(attempt)
+                logger.warning(f"Retrying {self.model_name} in {delay:.1f}s after {type(e).__name__}")
+                time.sleep(delay)
+                continue
+
+            scheduler.reconcile(estimated_tokens, self.actual_tokens(response, estimated_tokens),
+                                self.priority)
+            return response
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        scheduler = self.scheduler
+        estimated_tokens = self.estimate_tokens(input)
+
+        for attempt in range(self.max_retries + 1):
+            estimated_tokens = await scheduler.aacquire(estimated_tokens, self.priority)
+            try:
+                response = await self.llm.ainvoke(input, config, **kwargs)
+            except RateLimitError as e:
+                scheduler.pause(retry_after_seconds(e), self.priority)
+                if attempt == self.max_retries:
+                    raise
+                continue
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = transient_retry_seconds(attempt)
+                logger.warning(f"Retrying {self.model_name} in {delay:.1f}s after {type(e).__name__}")
+                await asyncio.sleep(delay)
+                continue
+
+            scheduler.reconcile(estimated_tokens, self.actual_tokens(response, estimated_tokens),
+                                self.priority)
+            return response
@@ -0,0 +1,180 @@
+import os
+import json
+import statistics
+import pymupdf
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from ingestion.utils.pdf_source import open_pdf, resolve_split_source
+
+LOCAL_ANALYZER_VERSION = "pymupdf-local-1"
+
+LAYOUT_DPI = 150
+MARGIN_RATIO = 0.06
+MIN_FIGURE_RATIO = 0.05
+HEADING_SIZE_RATIO = 1.3
+HEADING_MAX_CHARS = 120
+
+
+def to_bounding_box(rect: pymupdf.Rect, page_rect: pymupdf.Rect, scale: float) -> list[dict]:
+    x1, x2 = (round((value - page_rect.x0) * scale) for value in (rect.x0, rect.x1))
+    y1, y2 = (round((value - page_rect.y0) * scale) for value in (rect.y0, rect.y1))
+    return [
+        {"x": x1, "y": y1},
+        {"x": x2, "y": y1},
+        {"x": x2, "y": y2},
+        {"x": x1, "y": y2},
+    ]
+
+
+def overlaps(rect: pymupdf.Rect, regions: list[pymupdf.Rect], threshold: float = 0.5) -> bool:
+    area = rect.get_area()
+    if area == 0:
+        return any(region.contains(rect.tl) for region in regions)
+    return any((rect & region).get_area() / area >= threshold for region in regions)
+
+
+def block_text(block: dict) -> str:
+    return "\n".join(
+        "".join(span["text"] for span in line["spans"]) for line in block["lines"]
+    ).strip()
+
+
+def block_font_size(block: dict) -> float:
+    sizes = [span["size"] for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+    return max(sizes) if sizes else 0.0
+
+
+def classify_text_block(rect: pymupdf.Rect, text: str, font_size: float,
+                        body_font_size: float, page_rect: pymupdf.Rect) -> str:
+    margin = page_rect.height * MARGIN_RATIO
+    if rect.y1 <= page_rect.y0 + margin:
+        return "header"
+    if rect.y0 >= page_rect.y1 - margin:
+        return "footer"
+    if font_size >= body_font_size * HEADING_SIZE_RATIO and len(text) <= HEADING_MAX_CHARS:
+        return "heading1"
+    return "paragraph"
+
+
+def analyze_page(page: pymupdf.Page, page_number: int, dpi: int = LAYOUT_DPI):
+    scale = dpi / 72
+    page_rect = page.rect
+    elements = []
+
+    table_rects = []
+    for table in page.find_tables().tables:
+        rect = pymupdf.Rect(table.bbox)
+        table_rects.append(rect)
+        rows = table.extract()
+        text = "\n".join(" ".join(cell or "" for cell in row) for row in rows)
+        elements.append(("table", rect, text))
+
+    text_blocks = []
+    figure_rects = []
+    min_width = page_rect.width * MIN_FIGURE_RATIO
+    min_height = page_rect.height * MIN_FIGURE_RATIO
+
+    for block in page.get_text("dict", sort=True)["blocks"]:
+        rect = pymupdf.Rect(block["bbox"])
+        if overlaps(rect, table_rects):
+            continue
+        if block["type"] == 1:
+            if rect.width >= min_width and rect.height >= min_height:
+                figure_rects.append(rect)
+        elif block_text(block):
+            text_blocks.append((rect, block))
+
+    for rect in page.cluster_drawings():
+        if rect.width < min_width or rect.height < min_height:
+            continue
+        if overlaps(rect, table_rects) or overlaps(rect, figure_rects):
+            continue
+        figure_rects.append(rect)
+
+    for rect in figure_rects:
+        elements.append(("figure", rect, ""))
+
+    font_sizes = [block_font_size(block) for _, block in text_blocks]
+    body_font_size = statistics.median(font_sizes) if font_sizes else 0.0
+
+    for rect, block in text_blocks:
+        if overlaps(rect, figure_rects, threshold=0.9):
+            continue
+        text = block_text(block)
+        category = classify_text_block(rect, text, block_font_size(block),
+                                       body_font_size, page_rect)
+        elements.append((category, rect, text))
+
+    elements.sort(key=lambda element: (round(element[1].y0), element[1].x0))
+
+    metadata = {
+        "page": page_number,
+        "width": round(page_rect.width * scale),
+        "height": round(page_rect.height * scale),
+    }
+    page_elements = [
+        {
+            "category": category,
+            "page": page_number,
+            "bounding_box": to_bounding_box(rect, page_rect, scale),
+            "text": text,
+        }
+        for category, rect, text in elements
+    ]
+    return metadata, page_elements
+
+
+def analyze_pdf(pdf_file, dpi: int = LAYOUT_DPI) -> dict:
+    pages = []
+    elements = []
+
+    with open_pdf(pdf_file) as doc:
+        for page_index, page in enumerate(doc):
+            metadata, page_elements = analyze_page(page, page_index + 1, dpi)
+            pages.append(metadata)
+            elements.extend(page_elements)
+
+    for element_id, element in enumerate(elements):
+        element["id"] = element_id
+
+    return {
+        "model": LOCAL_ANALYZER_VERSION,
+        "metadata": {"pages": pages},
+        "elements": elements,
+    }
+
+
+def analyze_pdf_to_file(pdf_file, output_file, dpi: int = LAYOUT_DPI) -> str:
+    json_data = analyze_pdf(pdf_file, dpi)
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(json_data, f, ensure_ascii=False, indent=4)
+    return str(output_file)
+
+
+class LocalLayoutAnalyzer:
+    def __init__(self, analyzed_json_paths, max_workers=None, dpi=LAYOUT_DPI):
+        self.analyzed_json_paths = analyzed_json_paths
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.dpi = dpi
+
+    def output_file(self, file_path) -> str:
+        return os.path.join(self.analyzed_json_paths, Path(file_path).stem + ".json")
+
+    def analyze_files(self, file_paths: list[str], splitted_file_buffers=None) -> dict[str, str]:
+        sources = [resolve_split_source(file_path, splitted_file_buffers) or file_path
+                   for file_path in file_paths]
+
+        if self.max_workers <= 1 or len(file_paths) <= 1:
+            return {file_path: analyze_pdf_to_file(source, self.output_file(file_path), self.dpi)
+                    for file_path, source in zip(file_paths, sources)}
+
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(file_paths))) as executor:
+            results = executor.map(
+                analyze_pdf_to_file,
+                sources,
+                [self.output_file(file_path) for file_path in file_paths],
+                [self.dpi] * len(file_paths),
+                chunksize=max(1, len(file_paths) // (self.max_workers * 4)),
+            )
+            return dict(zip(file_paths, results))
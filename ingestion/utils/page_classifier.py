@@ -0,0 +1,64 @@
+import pymupdf
+
+from ingestion.utils.local_layout import MIN_FIGURE_RATIO
+from ingestion.utils.pdf_source import open_pdf
+
+ROUTE_LOCAL = "local"
+ROUTE_REMOTE = "remote"
+
+MIN_TEXT_CHARS = 50
+MIN_TEXT_COVERAGE = 0.02
+MAX_INVALID_CHAR_RATIO = 0.01
+
+
+def inspect_page(page: pymupdf.Page) -> dict:
+    page_rect = page.rect
+    page_area = page_rect.get_area() or 1.0
+    min_width = page_rect.width * MIN_FIGURE_RATIO
+    min_height = page_rect.height * MIN_FIGURE_RATIO
+
+    text = page.get_text("text")
+    text_chars = len(text.strip())
+    invalid_chars = text.count("�")
+
+    text_area = 0.0
+    num_images = 0
+    for block in page.get_text("dict")["blocks"]:
+        rect = pymupdf.Rect(block["bbox"])
+        if block["type"] == 0:
+            text_area += rect.get_area()
+        elif rect.width >= min_width and rect.height >= min_height:
+            num_images += 1
+
+    num_drawings = sum(
+        1 for rect in page.cluster_drawings()
+        if rect.width >= min_width and rect.height >= min_height
+    )
+
+    return {
+        "text_chars": text_chars,
+        "text_coverage": round(min(1.0, text_area / page_area), 4),
+        "invalid_char_ratio": round(invalid_chars / text_chars, 4) if text_chars else 0.0,
+        "num_images": num_images,
+        "num_drawings": num_drawings,
+    }
+
+
+def route_page(stats: dict) -> str:
+    if stats["num_images"] or stats["num_drawings"]:
+        return ROUTE_REMOTE
+    if stats["text_chars"] < MIN_TEXT_CHARS or stats["text_coverage"] < MIN_TEXT_COVERAGE:
+        return ROUTE_REMOTE
+    if stats["invalid_char_ratio"] > MAX_INVALID_CHAR_RATIO:
+        return ROUTE_REMOTE
+    return ROUTE_LOCAL
+
+
+def classify_pages(pdf_file) -> dict[int, dict]:
+    page_stats = dict()
+    with open_pdf(pdf_file) as doc:
+        for page_num, page in enumerate(doc):
+            stats = inspect_page(page)
+            stats["route"] = route_page(stats)
+            page_stats[page_num] = stats
+    return page_stats
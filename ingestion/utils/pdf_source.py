@@ -0,0 +1,51 @@
+import os
+import threading
+import pymupdf
+
+# In-memory split PDFs, keyed by split file path. They are kept out of FileState so
+# checkpoints only carry paths; after a restart, splits are read from disk instead.
+_split_buffers = dict()
+_split_buffers_lock = threading.Lock()
+
+
+def register_split_buffers(splitted_file_buffers):
+    with _split_buffers_lock:
+        _split_buffers.update(splitted_file_buffers)
+
+
+def release_split_buffers(file_paths=None):
+    with _split_buffers_lock:
+        if file_paths is None:
+            _split_buffers.clear()
+        for file_path in file_paths or ():
+            _split_buffers.pop(file_path, None)
+
+
+def get_split_buffer(file_path):
+    with _split_buffers_lock:
+        return _split_buffers.get(file_path)
+
+
+def open_pdf(source) -> pymupdf.Document:
+    if isinstance(source, (bytes, bytearray)):
+        return pymupdf.open(stream=source, filetype="pdf")
+    return pymupdf.open(source)
+
+
+def resolve_split_source(file_path, splitted_file_buffers=None):
+    if splitted_file_buffers and file_path in splitted_file_buffers:
+        return splitted_file_buffers[file_path]
+    buffer = get_split_buffer(file_path)
+    if buffer is not None:
+        return buffer
+    if os.path.exists(file_path):
+        return file_path
+    return None
+
+
+def read_split_bytes(file_path, splitted_file_buffers=None) -> bytes:
+    source = resolve_split_source(file_path, splitted_file_buffers)
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    with open(file_path, "rb") as f:
+        return f.read()
@@ -0,0 +1,196 @@
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from collections.abc import Mapping
+
+import numpy as np
+
+from ingestion.utils.element_store import ElementStore
+
+DOCUMENT_FORMAT = "rag-agent-processed-document"
+SCHEMA_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+ELEMENT_ARRAYS = ("ids", "pages", "category_codes", "bounding_boxes", "text_offsets")
+
+# State keys per section; a section is only read when one of its keys is accessed.
+SECTION_KEYS = {
+    "document": ("file_paths", "file_basename", "file_type", "language", "num_total_page"),
+    "page_metadata": ("page_metadata",),
+    "elements": ("page_elements",),
+    "texts": ("texts",),
+    "summaries": ("page_summaries", "image_summaries", "table_summaries"),
+    "markdowns": ("table_markdowns",),
+    "assets": ("image_paths", "table_paths"),
+}
+INT_KEYED = ("page_metadata", "texts", "page_summaries", "image_summaries", "table_summaries",
+             "table_markdowns", "image_paths", "table_paths")
+
+
+def sha256_file(file_path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def to_json_value(key, value):
+    if key == "file_paths":
+        return {name: str(path) for name, path in value.items()}
+    if key in ("image_paths", "table_paths"):
+        return {str(item_id): str(path) for item_id, path in value.items()}
+    if key in INT_KEYED:
+        return {str(item_id): item for item_id, item in value.items()}
+    return value
+
+
+def from_json_value(key, value):
+    if key == "file_paths":
+        return {name: Path(path) for name, path in value.items()}
+    if key in ("image_paths", "table_paths"):
+        return {int(item_id): Path(path) for item_id, path in value.items()}
+    if key in INT_KEYED:
+        return {int(item_id): item for item_id, item in value.items()}
+    return value
+
+
+def write_json(file_path, data):
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def document_path(state) -> Path:
+    return Path(state["file_paths"]["processed_dir"]) / f"{state['file_basename']}.doc"
+
+
+def save_processed_document(state, output_path=None) -> Path:
+    output_path = Path(output_path or document_path(state))
+    tmp_path = output_path.with_name(output_path.name + f".{os.getpid()}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    sections = dict()
+    for section, keys in SECTION_KEYS.items():
+        present_keys = [key for key in keys if state.get(key) is not None]
+        if not present_keys:
+            continue
+
+        files = dict()
+        if section == "elements":
+            store = state["page_elements"]
+            if not isinstance(store, ElementStore):
+                store = ElementStore.from_page_elements(store)
+            for name in ELEMENT_ARRAYS:
+                np.save(tmp_path / f"elements.{name}.npy", np.ascontiguousarray(getattr(store, name)))
+                files[name] = f"elements.{name}.npy"
+            with open(tmp_path / "elements.text.txt", "w", encoding="utf-8", newline="") as f:
+                f.write(store.text_buffer)
+            write_json(tmp_path / "elements.categories.json", list(store.categories))
+            files.update(text="elements.text.txt", categories="elements.categories.json")
+        else:
+            write_json(tmp_path / f"{section}.json",
+                       {key: to_json_value(key, state[key]) for key in present_keys})
+            files["data"] = f"{section}.json"
+
+        sections[section] = {
+            "keys": present_keys,
+            "files": {
+                name: {"path": file_name,
+                       "sha256": sha256_file(tmp_path / file_name),
+                       "bytes": (tmp_path / file_name).stat().st_size}
+                for name, file_name in files.items()
+            },
+        }
+
+    content_hash = hashlib.sha256()
+    for section in sorted(sections):
+        for name in sorted(sections[section]["files"]):
+            content_hash.update(sections[section]["files"][name]["sha256"].encode())
+
+    write_json(tmp_path / MANIFEST_FILE, {
+        "format": DOCUMENT_FORMAT,
+        "schema_version": SCHEMA_VERSION,
+        "file_basename": state.get("file_basename"),
+        "content_hash": content_hash.hexdigest(),
+        "sections": sections,
+    })
+
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+class ProcessedDocument(Mapping):
+    def __init__(self, path, verify=False, mmap=True):
+        self.path = Path(path)
+        self.mmap = mmap
+        with open(self.path / MANIFEST_FILE, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+
+        if self.manifest.get("format") != DOCUMENT_FORMAT:
+            raise ValueError(f"Not a processed document: {self.path}")
+        if self.manifest.get("schema_version") != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported processed document schema version: "
+                             f"{self.manifest.get('schema_version')} (expected {SCHEMA_VERSION})")
+
+        self.key_sections = {key: section for section, info in self.manifest["sections"].items()
+                             for key in info["keys"]}
+        self.loaded = dict()
+
+        if verify:
+            self.verify()
+
+    @property
+    def content_hash(self) -> str:
+        return self.manifest["content_hash"]
+
+    def section_file(self, section, name) -> Path:
+        return self.path / self.manifest["sections"][section]["files"][name]["path"]
+
+    def verify(self, sections=None):
+        for section in sections or self.manifest["sections"]:
+            for name, info in self.manifest["sections"][section]["files"].items():
+                if sha256_file(self.path / info["path"]) != info["sha256"]:
+                    raise ValueError(f"Processed document section is corrupted: {section}/{name}")
+
+    def load_elements(self) -> ElementStore:
+        mmap_mode = "r" if self.mmap else None
+        arrays = {name: np.load(self.section_file("elements", name), mmap_mode=mmap_mode)
+                  for name in ELEMENT_ARRAYS}
+        with open(self.section_file("elements", "categories"), "r", encoding="utf-8") as f:
+            categories = json.load(f)
+        with open(self.section_file("elements", "text"), "r", encoding="utf-8", newline="") as f:
+            text_buffer = f.read()
+        return ElementStore(categories=categories, text_buffer=text_buffer, **arrays)
+
+    def load_section(self, section) -> dict:
+        if section not in self.loaded:
+            if section == "elements":
+                self.loaded[section] = {"page_elements": self.load_elements()}
+            else:
+                with open(self.section_file(section, "data"), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.loaded[section] = {key: from_json_value(key, value)
+                                        for key, value in data.items()}
+        return self.loaded[section]
+
+    def __getitem__(self, key):
+        if key not in self.key_sections:
+            raise KeyError(key)
+        return self.load_section(self.key_sections[key])[key]
+
+    def __iter__(self):
+        return iter(self.key_sections)
+
+    def __len__(self):
+        return len(self.key_sections)
+
+    def loaded_sections(self) -> list[str]:
+        return list(self.loaded)
+
+
+def load_processed_document(path, verify=False, mmap=True) -> ProcessedDocument:
+    return ProcessedDocument(path, verify=verify, mmap=mmap)
@@ -0,0 +1,45 @@
+import numpy as np
+
+RRF_K = 60
+FUSION_METHODS = ("rrf", "score")
+
+
+def min_max_normalize(scores) -> np.ndarray:
+    scores = np.asarray(scores, dtype=np.float32)
+    if not len(scores):
+        return scores
+    low, high = scores.min(), scores.max()
+    if high == low:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+# Each ranking is (doc_ids, scores) ordered best first, with higher scores better.
+# Returns the fused candidates best first, their fused scores and a
+# (num_candidates, num_rankings) matrix of per-ranking scores (NaN when absent).
+def fuse_rankings(rankings, weights, method="rrf", c=RRF_K):
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Invalid fusion method: {method}")
+    if len(rankings) != len(weights):
+        raise ValueError(f"Got {len(rankings)} rankings but {len(weights)} weights")
+
+    doc_ids = np.concatenate([np.asarray(ids, dtype=np.int64) for ids, _ in rankings])
+    candidates, inverse = np.unique(doc_ids, return_inverse=True)
+
+    contributions = []
+    for (ids, scores), weight in zip(rankings, weights):
+        if method == "rrf":
+            contributions.append(weight / (c + np.arange(1, len(ids) + 1, dtype=np.float64)))
+        else:
+            contributions.append(weight * min_max_normalize(scores).astype(np.float64))
+    fused = np.bincount(inverse, weights=np.concatenate(contributions),
+                        minlength=len(candidates))
+
+    per_ranking = np.full((len(candidates), len(rankings)), np.nan, dtype=np.float32)
+    offset = 0
+    for column, (ids, scores) in enumerate(rankings):
+        per_ranking[inverse[offset:offset + len(ids)], column] = scores
+        offset += len(ids)
+
+    order = np.argsort(-fused, kind="stable")
+    return candidates[order], fused[order], per_ranking[order]
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from ingestion import logger
+from ingestion.utils.bm25 import BM25Index
+from ingestion.utils.vector_index import create_vector_index, set_search_params
+
+INDEX_FORMAT = "rag-agent-retriever-index"
+SCHEMA_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+FAISS_FILE = "faiss.index"
+BM25_DIR = "bm25"
+DOCSTORE_FILE = "docstore.jsonl"
+
+
+def serialize_document(doc: Document) -> str:
+    return json.dumps({"page_content": doc.page_content, "metadata": doc.metadata},
+                      ensure_ascii=False, sort_keys=True, default=str)
+
+
+def corpus_hash(docs: list[Document]) -> str:
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(serialize_document(doc).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def embedding_model_name(embedding) -> str:
+    return getattr(embedding, "model", None) or embedding.__class__.__name__
+
+
+def read_manifest(index_dir):
+    manifest_path = Path(index_dir) / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != INDEX_FORMAT or manifest.get("schema_version") != SCHEMA_VERSION:
+        return None
+    return manifest
+
+
+def is_index_current(index_dir, docs: list[Document], embedding_model: str,
+                     bm25_params=None, vector_index_params=None) -> bool:
+    manifest = read_manifest(index_dir)
+    return (manifest is not None
+            and manifest["corpus_hash"] == corpus_hash(docs)
+            and manifest["embedding_model"] == embedding_model
+            and manifest["bm25_params"] == (bm25_params or {})
+            and manifest.get("vector_index_params", {}) == (vector_index_params or {}))
+
+
+def build_index(docs: list[Document], index_dir, embedding, bm25_params=None,
+                vector_index_params=None, force=False) -> Path:
+    index_dir = Path(index_dir)
+    embedding_model = embedding_model_name(embedding)
+    if not force and is_index_current(index_dir, docs, embedding_model, bm25_params,
+                                      vector_index_params):
+        return index_dir
+
+    if not docs:
+        raise ValueError("Cannot build a retriever index from an empty corpus")
+
+    tmp_dir = index_dir.with_name(index_dir.name + f".{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    texts = [doc.page_content for doc in docs]
+    start = time.perf_counter()
+    vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+    seconds = time.perf_counter() - start
+
+    logger.info(json.dumps({
+        "message": "Embedded retriever corpus",
+        "num_docs": len(texts),
+        "seconds": round(seconds, 3),
+        "docs_per_second": round(len(texts) / seconds, 1) if seconds else 0.0,
+        "embedding_cache": embedding.stats() if hasattr(embedding, "stats") else None,
+    }, ensure_ascii=False, indent=2))
+
+    vector_index_params = vector_index_params or {}
+    index, vector_index = create_vector_index(vectors, **vector_index_params)
+    faiss.write_index(index, str(tmp_dir / FAISS_FILE))
+
+    bm25_params = bm25_params or {}
+    bm25 = BM25Index.from_texts(texts, **bm25_params)
+    bm25.save(tmp_dir / BM25_DIR)
+
+    with open(tmp_dir / DOCSTORE_FILE, "w", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(serialize_document(doc) + "\n")
+
+    with open(tmp_dir / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump({
+            "format": INDEX_FORMAT,
+            "schema_version": SCHEMA_VERSION,
+            "corpus_hash": corpus_hash(docs),
+            "embedding_model": embedding_model,
+            "dimension": int(vectors.shape[1]),
+            "num_docs": len(docs),
+            "bm25_params": bm25_params,
+            "bm25_tokenizer": bm25.tokenizer_name,
+            "vector_index_params": vector_index_params,
+            "vector_index": vector_index,
+        }, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+    return index_dir
+
+
+def load_docs(file_path) -> list[Document]:
+    with open(file_path, "r", encoding="utf-8") as f:
+        return [Document(**json.loads(line)) for line in f if line.strip()]
+
+
+def load_index(index_dir, mmap=True, nprobe=None, ef_search=None):
+    index_dir = Path(index_dir)
+    manifest = read_manifest(index_dir)
+    if manifest is None:
+        raise ValueError(f"Missing or unsupported retriever index: {index_dir}")
+
+    io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    index = faiss.read_index(str(index_dir / FAISS_FILE), io_flags)
+    vector_index = manifest.get("vector_index", {})
+    set_search_params(index,
+                      nprobe=nprobe if nprobe is not None else vector_index.get("nprobe"),
+                      ef_search=ef_search if ef_search is not None else vector_index.get("ef_search"))
+    docs = load_docs(index_dir / DOCSTORE_FILE)
+    if index.ntotal != len(docs):
+        raise ValueError(f"Retriever index is inconsistent: {index.ntotal} vectors, "
+                         f"{len(docs)} documents")
+
+    bm25 = BM25Index.load(index_dir / BM25_DIR, mmap=mmap)
+    return manifest, index, bm25, docs
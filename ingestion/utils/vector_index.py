@@ -0,0 +1,151 @@
+import math
+import time
+
+import faiss
+import numpy as np
+
+VECTOR_INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq8")
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+PQ_MAX_NBITS = 8
+
+# faiss k-means wants at least 39 training points per centroid.
+MIN_POINTS_PER_CENTROID = 39
+
+
+def default_nlist(num_vectors: int) -> int:
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def default_pq_m(dimension: int) -> int:
+    # Largest sub-quantizer count with at least 8 dimensions per sub-vector.
+    for pq_m in range(max(1, dimension // 8), 0, -1):
+        if dimension % pq_m == 0:
+            return pq_m
+    return 1
+
+
+def default_pq_nbits(num_vectors: int) -> int:
+    return max(1, min(PQ_MAX_NBITS, int(math.log2(max(2, num_vectors // MIN_POINTS_PER_CENTROID)))))
+
+
+def resolve_index_params(index_type: str, num_vectors: int, dimension: int, **params) -> dict:
+    if index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(f"Invalid vector index type: {index_type}")
+
+    resolved = {"index_type": index_type}
+    if index_type == "hnsw":
+        resolved["hnsw_m"] = params.pop("hnsw_m", HNSW_M)
+        resolved["ef_construction"] = params.pop("ef_construction", HNSW_EF_CONSTRUCTION)
+        resolved["ef_search"] = params.pop("ef_search", HNSW_EF_SEARCH)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        resolved["nlist"] = min(params.pop("nlist", None) or default_nlist(num_vectors), num_vectors)
+        resolved["nprobe"] = min(params.pop("nprobe", IVF_NPROBE), resolved["nlist"])
+    if index_type == "ivf_pq":
+        resolved["pq_m"] = params.pop("pq_m", None) or default_pq_m(dimension)
+        resolved["pq_nbits"] = params.pop("pq_nbits", None) or default_pq_nbits(num_vectors)
+        if dimension % resolved["pq_m"]:
+            raise ValueError(f"pq_m={resolved['pq_m']} does not divide dimension {dimension}")
+
+    if params:
+        raise ValueError(f"Unsupported parameters for {index_type} index: {sorted(params)}")
+    return resolved
+
+
+def create_vector_index(vectors, index_type="flat", **params):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dimension = vectors.shape
+    params = resolve_index_params(index_type, num_vectors, dimension, **params)
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+    elif index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, params["nlist"])
+    elif index_type == "ivf_pq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, params["nlist"],
+                                 params["pq_m"], params["pq_nbits"])
+    else:
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit)
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    set_search_params(index, nprobe=params.get("nprobe"), ef_search=params.get("ef_search"))
+    return index, params
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    if nprobe is not None:
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = nprobe
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+# Size of the index as written to disk. Resident memory differs, notably for HNSW graph
+# links and IVF lists (allocator overhead) and for indexes loaded with IO_FLAG_MMAP.
+def serialized_index_nbytes(index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def recall_at_k(found_ids, true_ids) -> float:
+    hits = (found_ids[:, :, None] == true_ids[:, None, :]) & (true_ids[:, None, :] >= 0)
+    return float(hits.any(axis=2).sum() / max(1, (true_ids >= 0).sum()))
+
+
+def compare_vector_indexes(vectors, query_vectors=None, index_configs=None, k=10,
+                           num_queries=200, seed=0) -> list[dict]:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if query_vectors is None:
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+        query_vectors = vectors[sample]
+    query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+    index_configs = index_configs or [{"index_type": index_type} for index_type in VECTOR_INDEX_TYPES]
+
+    exact, _ = create_vector_index(vectors, "flat")
+    _, true_ids = exact.search(query_vectors, k)
+
+    report = []
+    for config in index_configs:
+        config = dict(config)
+        start = time.perf_counter()
+        index, params = create_vector_index(vectors, config.pop("index_type"), **config)
+        build_seconds = time.perf_counter() - start
+
+        # One query per call, as the retriever issues them.
+        found_ids, latencies = [], []
+        for query_vector in query_vectors:
+            start = time.perf_counter()
+            _, ids = index.search(query_vector[None, :], k)
+            latencies.append(time.perf_counter() - start)
+            found_ids.append(ids[0])
+
+        nbytes = serialized_index_nbytes(index)
+        report.append({
+            **params,
+            f"recall@{k}": round(recall_at_k(np.vstack(found_ids), true_ids), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+            "serialized_bytes": nbytes,
+            "serialized_bytes_per_vector": round(nbytes / len(vectors), 1),
+            "build_seconds": round(build_seconds, 3),
+        })
+    return report
+
+
+def format_vector_index_report(report: list[dict]) -> str:
+    columns = list(dict.fromkeys(key for row in report for key in row))
+    rows = [[str(row.get(column, "")) for column in columns] for row in report]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines.extend("  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in rows)
+    return "\n".join(lines)